@@ -0,0 +1,320 @@
+"""
+Benchmark of the image encoder on a synthetic corpus of price labels.
+
+Run it from the root of the repository, for example:
+
+    poetry run python benchmarks/encoder.py --output results.json
+    poetry run python benchmarks/encoder.py --baseline results.json
+
+Each result reports the time per image and, for the operations that produce image data, the
+payload size in bytes and in transfer blocks. Results are written as JSON, so that they can be
+compared across commits with `--baseline`.
+"""
+
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import platform
+import numpy as np
+import PIL
+from PIL import Image, ImageDraw, ImageFont
+from gicisky_tag.encoder import (
+    Dither,
+    Compression,
+    dither_image_bwr,
+    dither_bwr_indices,
+    encode_image,
+    encode_line,
+    compress_bitmap,
+    plane_lookup,
+)
+from gicisky_tag.models import Layout, MODELS, DEFAULT_MODEL
+
+# Kinds of labels of the corpus
+LABEL_KINDS = ("text", "barcode", "photo", "blank")
+
+# The largest write with the common ATT MTU of 247 bytes
+DEFAULT_BLOCK_SIZE = 244
+
+
+def draw_text_lines(draw, rng, width, height):
+    """Draw a product name, a price and, sometimes, a red discount, like on a price label."""
+    name = " ".join(
+        "".join(
+            rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 8))
+        )
+        for _ in range(rng.randint(1, 3))
+    ).capitalize()
+    draw.text((4, 2), name, fill="black", font=ImageFont.load_default(height // 8))
+    price = f"{rng.randint(0, 99)}.{rng.randint(0, 99):02}"
+    draw.text(
+        (4, height // 4),
+        price,
+        fill="black",
+        font=ImageFont.load_default(height // 3),
+    )
+    if rng.random() < 0.5:
+        draw.text(
+            (4, height * 2 // 3),
+            f"-{rng.randint(1, 9)}0%",
+            fill="red",
+            font=ImageFont.load_default(height // 5),
+        )
+
+
+def draw_barcode(draw, rng, box):
+    """Draw a random barcode with its digits below, in the `(left, top, right, bottom)` box."""
+    left, top, right, bottom = box
+    digits = "".join(rng.choice("0123456789") for _ in range(13))
+    font = ImageFont.load_default(max((bottom - top) // 6, 8))
+    bars_bottom = bottom - (bottom - top) // 5
+    x = left
+    while x < right:
+        bar_width = rng.randint(1, 3)
+        if rng.random() < 0.5:
+            draw.rectangle((x, top, x + bar_width - 1, bars_bottom), fill="black")
+        x += bar_width
+    draw.text((left, bars_bottom + 1), digits, fill="black", font=font)
+
+
+def make_photo(rng, size):
+    """A smooth random color image, like a small product photo."""
+    width, height = size
+    np_rng = np.random.default_rng(rng.getrandbits(32))
+    noise = np_rng.integers(0, 256, (max(height // 16, 2), max(width // 16, 2), 3))
+    photo = Image.fromarray(noise.astype(np.uint8), "RGB")
+    return photo.resize(size, Image.BICUBIC)
+
+
+def make_label(kind, rng, size):
+    """Generate a label of the given kind and size, with random content drawn from `rng`."""
+    width, height = size
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    if kind == "text":
+        draw_text_lines(draw, rng, width, height)
+    elif kind == "barcode":
+        draw_text_lines(draw, rng, width, height)
+        draw_barcode(draw, rng, (width // 2, height // 4, width - 4, height - 2))
+    elif kind == "photo":
+        photo_size = (width // 2, height)
+        image.paste(make_photo(rng, photo_size), (width - photo_size[0], 0))
+        draw_text_lines(draw, rng, width // 2, height)
+    elif kind == "blank":
+        draw.rectangle((0, 0, width - 1, height - 1), outline="black")
+        draw.text(
+            (4, 2), "SKU", fill="black", font=ImageFont.load_default(height // 10)
+        )
+    else:
+        raise ValueError(f"Unknown label kind: {kind}")
+    return image
+
+
+def make_corpus(size, labels_per_kind, seed=0):
+    """Generate the corpus of labels, as a dict from each kind of label to a list of images."""
+    rng = random.Random(seed)
+    return {
+        kind: [make_label(kind, rng, size) for _ in range(labels_per_kind)]
+        for kind in LABEL_KINDS
+    }
+
+
+def time_per_item(function, items, repeat):
+    """Best time, over `repeat` runs, of `function` called on each item, divided by the items."""
+    function(items[0])  # Warm up imports and lookup tables
+    best = math.inf
+    for _ in range(repeat):
+        # Start each run with the same cold cache of encoded lines
+        encode_line.cache_clear()
+        start = time.perf_counter()
+        for item in items:
+            function(item)
+        best = min(best, time.perf_counter() - start)
+    return best / len(items)
+
+
+def payload_stats(payloads, block_size):
+    """Mean payload size in bytes and in transfer blocks, each carrying `block_size - 4` bytes."""
+    sizes = [len(payload) for payload in payloads]
+    blocks = [math.ceil(size / (block_size - 4)) for size in sizes]
+    return {
+        "payload_bytes": sum(sizes) / len(sizes),
+        "payload_blocks": sum(blocks) / len(blocks),
+    }
+
+
+def run_benchmarks(corpus, model, repeat, block_size):
+    """Run all the benchmarks on the corpus, returning a list of results."""
+    results = []
+
+    def add_result(benchmark, kind, seconds, **fields):
+        result = {"benchmark": benchmark, "label_kind": kind, **fields}
+        result["time_per_image"] = seconds
+        results.append(result)
+        print(
+            f"{benchmark:<16} {kind:<8} {seconds * 1e3:7.3f} ms/image "
+            + " ".join(f"{key}={value}" for key, value in fields.items()),
+            file=sys.stderr,
+        )
+
+    for kind, images in corpus.items():
+        for dithering in Dither:
+            seconds = time_per_item(
+                lambda image: dither_image_bwr(image, dithering), images, repeat
+            )
+            add_result("dither_image_bwr", kind, seconds, dithering=str(dithering))
+
+        for compression in Compression:
+            encode = lambda image: encode_image(
+                image, model=model, compression=compression
+            )
+            seconds = time_per_item(encode, images, repeat)
+            stats = payload_stats(map(encode, images), block_size)
+            add_result(
+                "encode_image", kind, seconds, compression=str(compression), **stats
+            )
+
+        if model.layout == Layout.COLUMNS and model.rotation == 0:
+            # The black/white plane, with one row per column of the image
+            bitmaps = [
+                np.packbits(
+                    plane_lookup[0][dither_bwr_indices(image, Dither.NONE).T], axis=1
+                )
+                for image in images
+            ]
+            for compression in Compression:
+                compress = lambda bitmap: compress_bitmap(
+                    bitmap, model.size, compression=compression
+                )
+                seconds = time_per_item(compress, bitmaps, repeat)
+                stats = payload_stats(map(compress, bitmaps), block_size)
+                add_result(
+                    "compress_bitmap",
+                    kind,
+                    seconds,
+                    compression=str(compression),
+                    **stats,
+                )
+    return results
+
+
+def result_key(result):
+    """The fields that identify a result, to match it with the same result of another run."""
+    return tuple(
+        (key, value)
+        for key, value in result.items()
+        if key not in ("time_per_image", "payload_bytes", "payload_blocks")
+    )
+
+
+def compare_results(results, baseline, tolerance):
+    """Print the changes from the baseline results, returning whether there are regressions."""
+    baseline_results = {result_key(result): result for result in baseline["results"]}
+    regressions = False
+    for result in results:
+        old_result = baseline_results.get(result_key(result))
+        if old_result is None:
+            continue
+        description = " ".join(f"{value}" for _, value in result_key(result))
+        time_ratio = result["time_per_image"] / old_result["time_per_image"]
+        message = f"{description}: time x{time_ratio:.2f}"
+        regression = time_ratio > 1 + tolerance
+        if "payload_bytes" in result:
+            size_change = result["payload_bytes"] - old_result["payload_bytes"]
+            message += f", payload {size_change:+.1f} bytes"
+            regression |= size_change > 0
+        if regression:
+            message += " REGRESSION"
+            regressions = True
+        print(message, file=sys.stderr)
+    return regressions
+
+
+def parser():
+    parser = argparse.ArgumentParser(description="Benchmark the image encoder.")
+    parser.add_argument(
+        "--model",
+        choices=list(MODELS),
+        default=DEFAULT_MODEL.name,
+        help=f"Model of the tag for which labels are encoded (default: {DEFAULT_MODEL}).",
+    )
+    parser.add_argument(
+        "--labels",
+        type=int,
+        default=10,
+        help="Number of labels of each kind in the corpus (default: 10).",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="Number of runs of each benchmark, of which the best one is reported (default: 5).",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Seed of the corpus (default: 0)."
+    )
+    parser.add_argument(
+        "--block-size",
+        type=int,
+        default=DEFAULT_BLOCK_SIZE,
+        help=f"Block size of the image transfer (default: {DEFAULT_BLOCK_SIZE}).",
+    )
+    parser.add_argument(
+        "--output", type=str, help="File in which to save the results as JSON."
+    )
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        help="JSON results of a previous run, to which the results are compared.",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help=(
+            "Relative slowdown from the baseline reported as a regression (default: 0.1). "
+            "Any increase of the payload size is reported as a regression."
+        ),
+    )
+    return parser
+
+
+def main():
+    args = parser().parse_args()
+    model = MODELS[args.model]
+    corpus = make_corpus(model.size, args.labels, seed=args.seed)
+    results = run_benchmarks(corpus, model, args.repeat, args.block_size)
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pillow": PIL.__version__,
+            "machine": platform.machine(),
+        },
+        "parameters": {
+            "model": model.name,
+            "labels": args.labels,
+            "repeat": args.repeat,
+            "seed": args.seed,
+            "block_size": args.block_size,
+        },
+        "results": results,
+    }
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if compare_results(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
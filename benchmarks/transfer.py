@@ -0,0 +1,163 @@
+"""
+Benchmark of the image transfer on simulated tags, which doesn't need any Bluetooth hardware.
+
+Run it from the root of the repository, for example:
+
+    poetry run python benchmarks/transfer.py --latency 0.015 --processing-time 0.005 --loss 0.01
+
+Each result reports the mean time to transfer the image data of a label, for each transfer window,
+together with the number of image blocks written and lost and the round trip time of the blocks.
+Results are written as JSON.
+"""
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+from encoder import make_corpus
+from gicisky_tag.encoder import encode_image
+from gicisky_tag.models import MODELS, DEFAULT_MODEL
+from gicisky_tag.simulator import SimulatedTag
+from gicisky_tag.metrics import TransferMetrics, percentile
+from gicisky_tag.writer import write_image
+
+
+async def time_transfers(payloads, window, tag_options, seed):
+    """Transfer each payload to a new simulated tag, returning the mean time and the block counts."""
+    total_time = 0.0
+    num_writes = 0
+    num_lost_writes = 0
+    round_trips = []
+    for index, image_data in enumerate(payloads):
+        async with SimulatedTag(seed=seed + index, **tag_options) as tag:
+            metrics = TransferMetrics()
+            start = time.perf_counter()
+            await write_image(tag, image_data, window=window, metrics=metrics)
+            total_time += time.perf_counter() - start
+            round_trips += metrics.block_round_trips
+            assert tag.image_data == image_data, "The tag received corrupted data"
+            num_writes += tag.num_writes
+            num_lost_writes += tag.num_lost_writes
+    return {
+        "time_per_image": total_time / len(payloads),
+        "blocks_written": num_writes / len(payloads),
+        "blocks_lost": num_lost_writes / len(payloads),
+        "block_round_trip_p50": percentile(round_trips, 0.5),
+        "block_round_trip_p90": percentile(round_trips, 0.9),
+    }
+
+
+def parser():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the image transfer on simulated tags."
+    )
+    parser.add_argument(
+        "--model",
+        choices=list(MODELS),
+        default=DEFAULT_MODEL.name,
+        help=f"Model of the simulated tags (default: {DEFAULT_MODEL}).",
+    )
+    parser.add_argument(
+        "--labels",
+        type=int,
+        default=4,
+        help="Number of labels of each kind to transfer (default: 4).",
+    )
+    parser.add_argument(
+        "--windows",
+        type=int,
+        nargs="+",
+        default=[0, 4, 16],
+        help="Transfer windows to benchmark, 0 for one block at a time (default: 0 4 16).",
+    )
+    parser.add_argument(
+        "--block-size",
+        type=int,
+        default=244,
+        help="Block size of the simulated tags (default: 244).",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.015,
+        help="Time for each packet to go through the link, in seconds (default: 0.015).",
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=0.0,
+        help="Random variation of the latency, in seconds (default: 0).",
+    )
+    parser.add_argument(
+        "--processing-time",
+        type=float,
+        default=0.005,
+        help="Time for the tag to handle each write, in seconds (default: 0.005).",
+    )
+    parser.add_argument(
+        "--loss",
+        type=float,
+        default=0.0,
+        help="Probability that a write without response is lost (default: 0).",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Seed of the corpus and of the tags."
+    )
+    parser.add_argument(
+        "--output", type=str, help="File in which to save the results as JSON."
+    )
+    return parser
+
+
+def main():
+    args = parser().parse_args()
+    model = MODELS[args.model]
+    corpus = make_corpus(model.size, args.labels, seed=args.seed)
+    payloads = [
+        bytes(encode_image(image, model=model))
+        for images in corpus.values()
+        for image in images
+    ]
+    tag_options = {
+        "model": model,
+        "block_size": args.block_size,
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "processing_time": args.processing_time,
+        "loss": args.loss,
+    }
+
+    results = []
+    for window in args.windows:
+        result = asyncio.run(
+            time_transfers(payloads, window or None, tag_options, args.seed)
+        )
+        result = {"benchmark": "write_image", "window": window, **result}
+        results.append(result)
+        print(
+            f"window {window:<3} {result['time_per_image'] * 1e3:8.1f} ms/image "
+            f"{result['blocks_written']:.1f} blocks written, {result['blocks_lost']:.1f} lost",
+            file=sys.stderr,
+        )
+
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+        },
+        "parameters": {
+            key: value for key, value in vars(args).items() if key != "output"
+        },
+        "results": results,
+    }
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
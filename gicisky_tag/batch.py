@@ -0,0 +1,89 @@
+import os
+import itertools
+import functools
+import collections
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+from gicisky_tag.encoder import encode_image, Dither, Compression
+from gicisky_tag.models import DEFAULT_MODEL, get_model
+from gicisky_tag.log import logger
+
+
+def encode_chunk(items, dithering, compression):
+    """Encode a list of `(image, model)` pairs, returning the image data of each one as `bytes`.
+
+    Each image can be a PIL image or the path of an image file.
+    """
+    results = []
+    for item, model in items:
+        if isinstance(item, (str, os.PathLike)):
+            with Image.open(item) as image:
+                image_data = encode_image(
+                    image, dithering=dithering, model=model, compression=compression
+                )
+        else:
+            image_data = encode_image(
+                item, dithering=dithering, model=model, compression=compression
+            )
+        results.append(bytes(image_data))
+    return results
+
+
+def split_chunks(items, chunk_size):
+    """Split the iterable `items` into lists of `chunk_size` items, the last one can be shorter."""
+    items = iter(items)
+    while chunk := list(itertools.islice(items, chunk_size)):
+        yield chunk
+
+
+def encode_images(
+    images,
+    workers=None,
+    dithering=Dither.NONE,
+    model=DEFAULT_MODEL,
+    compression=Compression.FAST,
+    chunk_size=8,
+    max_pending=None,
+    models=None,
+):
+    """Encode many images in parallel, yielding the image data of each one as `bytes`, in order.
+
+    The items of `images` can be PIL images or paths of image files. Paths are cheaper, because the
+    files are loaded by the worker processes instead of being sent to them. Images are encoded in
+    chunks of `chunk_size` by `workers` processes (by default, one per core), and at most
+    `max_pending` chunks (by default, two per worker) are queued at any time, so `images` can be a
+    lazy iterable of any length.
+
+    To encode images for tags of different models, `models` can provide the model of each image,
+    overriding `model`.
+    """
+    if models is None:
+        items = zip(images, itertools.repeat(model))
+    else:
+        items = zip(images, models, strict=True)
+    workers = workers or os.cpu_count() or 1
+    encode = functools.partial(
+        encode_chunk, dithering=dithering, compression=compression
+    )
+    # Models are sent to the worker processes by name
+    items = ((image, get_model(model).name) for image, model in items)
+    chunks = split_chunks(items, chunk_size)
+    if workers == 1:
+        for chunk in chunks:
+            yield from encode(chunk)
+        return
+
+    max_pending = max_pending or 2 * workers
+    logger.debug(f"Encoding images with {workers} processes")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        try:
+            for chunk in chunks:
+                if len(pending) >= max_pending:
+                    yield from pending.popleft().result()
+                pending.append(executor.submit(encode, chunk))
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
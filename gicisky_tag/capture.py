@@ -0,0 +1,248 @@
+"""
+Capture of the packets exchanged with the tags, in a compact binary file.
+
+The capture file starts with `CAPTURE_MAGIC`, followed by one record per packet: a `RECORD` header
+with the Unix timestamp, the `PacketKind`, the length of the address and the length of the data,
+followed by the address of the tag (ASCII) and the raw data of the packet.
+
+Run `gicisky-capture FILE` to print a capture, or see `--help` to extract the transferred images.
+"""
+
+import sys
+import time
+import struct
+import argparse
+from enum import IntEnum
+from os import path
+from gicisky_tag.decoder import decode_image, render_image
+from gicisky_tag.models import MODELS, DEFAULT_MODEL
+
+CAPTURE_MAGIC = b"GICISKY-CAPTURE\x01"
+
+# Timestamp, kind of packet, length of the address and length of the data
+RECORD = struct.Struct("<dBBH")
+
+# The capture in progress, if any. See `start_capture`.
+active_capture = None
+
+
+class PacketKind(IntEnum):
+    """Kind of a captured packet.
+
+    Possible values:
+    * REQUEST: request written to the request characteristic.
+    * IMAGE: image block written to the image characteristic, with response.
+    * IMAGE_NO_RESPONSE: image block written to the image characteristic, without response.
+    * NOTIFICATION: notification of the tag on the request characteristic.
+    """
+
+    REQUEST = 1
+    IMAGE = 2
+    IMAGE_NO_RESPONSE = 3
+    NOTIFICATION = 4
+
+    def __str__(self):
+        return self.name.lower()
+
+
+class WireCapture:
+    """
+    Writer of a capture file. Packets are appended to the file if it already exists.
+
+    Attributes:
+    - path: The path of the capture file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(CAPTURE_MAGIC)
+
+    def record(self, kind, address, data):
+        address = address.encode("ascii")
+        self.file.write(RECORD.pack(time.time(), kind, len(address), len(data)))
+        self.file.write(address)
+        self.file.write(data)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def start_capture(path):
+    """Start capturing the packets of all the updates to the file at `path`."""
+    global active_capture
+    stop_capture()
+    active_capture = WireCapture(path)
+    return active_capture
+
+
+def stop_capture():
+    global active_capture
+    if active_capture is not None:
+        active_capture.close()
+        active_capture = None
+
+
+class Packet:
+    """
+    A packet read from a capture file.
+
+    Attributes:
+    - timestamp: When the packet was captured, as a Unix timestamp.
+    - kind: The `PacketKind` of the packet.
+    - address: The Bluetooth address of the tag.
+    - data: The raw data of the packet.
+    """
+
+    def __init__(self, timestamp, kind, address, data):
+        self.timestamp = timestamp
+        self.kind = kind
+        self.address = address
+        self.data = data
+
+    def __repr__(self):
+        return f"Packet({self.address}, {self.kind}, {self.data.hex()})"
+
+    def describe(self):
+        """A human-readable description of the meaning of the packet in the transfer protocol."""
+        data = self.data
+        if self.kind in (PacketKind.IMAGE, PacketKind.IMAGE_NO_RESPONSE):
+            part = int.from_bytes(data[:4], "little")
+            return f"image part {part + 1}, {len(data) - 4} bytes"
+        if self.kind == PacketKind.REQUEST:
+            if data[:1] == b"\x01":
+                return "request block size"
+            if data[:1] == b"\x02":
+                return (
+                    f"request write screen, {int.from_bytes(data[1:5], 'little')} bytes"
+                )
+            if data[:1] == b"\x03":
+                return "request start transfer"
+            if data[:1] == b"\x04":
+                return "request write cancel"
+        if self.kind == PacketKind.NOTIFICATION:
+            if data[:1] == b"\x01":
+                return f"block size {int.from_bytes(data[1:3], 'little')}"
+            if data[:2] == b"\x02\x00":
+                return "write screen accepted"
+            if data[:2] == b"\x05\x00":
+                return f"tag requests part {int.from_bytes(data[2:6], 'little') + 1}"
+            if data[:2] == b"\x05\x08":
+                return "screen write complete"
+        return data.hex(" ")
+
+
+def read_capture(path):
+    """Read the packets of a capture file, yielding a `Packet` for each one."""
+    with open(path, "rb") as capture_file:
+        if capture_file.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError(f"{path} is not a capture file")
+        while header := capture_file.read(RECORD.size):
+            if len(header) < RECORD.size:
+                raise ValueError(f"{path} ends with a truncated packet")
+            timestamp, kind, address_length, data_length = RECORD.unpack(header)
+            address = capture_file.read(address_length).decode("ascii")
+            data = capture_file.read(data_length)
+            if len(data) < data_length:
+                raise ValueError(f"{path} ends with a truncated packet")
+            yield Packet(timestamp, PacketKind(kind), address, data)
+
+
+def replay_transfers(packets):
+    """Replay the transfers of the captured packets, yielding `(packet, image_data)` pairs.
+
+    Each pair is yielded for the packet that completes a transfer, with the image data received by
+    the tag, as it was reassembled from the image blocks that the tag requested.
+    """
+    # For each address, the image size and the blocks of the ongoing transfer
+    transfers = {}
+    for packet in packets:
+        data = packet.data
+        if packet.kind == PacketKind.REQUEST and data[:1] == b"\x02":
+            size = int.from_bytes(data[1:5], "little")
+            previous_size, blocks = transfers.get(packet.address, (None, {}))
+            # Like the tag, keep the received blocks if the transfer is resumed
+            transfers[packet.address] = (size, blocks if size == previous_size else {})
+        elif packet.kind in (PacketKind.IMAGE, PacketKind.IMAGE_NO_RESPONSE):
+            if packet.address in transfers:
+                part = int.from_bytes(data[:4], "little")
+                transfers[packet.address][1][part] = data[4:]
+        elif packet.kind == PacketKind.NOTIFICATION and data[:2] == b"\x05\x08":
+            if packet.address in transfers:
+                size, blocks = transfers.pop(packet.address)
+                image_data = b"".join(blocks[part] for part in sorted(blocks))
+                yield packet, image_data[:size]
+
+
+def parser():
+    parser = argparse.ArgumentParser(
+        description="Print the packets of a capture file written by gicisky-tag-writer."
+    )
+    parser.add_argument("capture_file", type=str, help="The capture file.")
+    parser.add_argument(
+        "--address", type=str, help="Only show the packets of this Bluetooth address."
+    )
+    parser.add_argument(
+        "--hex", action="store_true", help="Also print the raw data of each packet."
+    )
+    parser.add_argument(
+        "--images-folder",
+        type=str,
+        help=(
+            "Folder in which to save the image data of each completed transfer, "
+            "and the image as it would look on the screen."
+        ),
+    )
+    parser.add_argument(
+        "--model",
+        choices=list(MODELS),
+        default=DEFAULT_MODEL.name,
+        help=f"Model of the tags, used to render the images (default: {DEFAULT_MODEL}).",
+    )
+    return parser
+
+
+def main():
+    args = parser().parse_args()
+    packets = [
+        packet
+        for packet in read_capture(args.capture_file)
+        if args.address is None or packet.address.upper() == args.address.upper()
+    ]
+    if not packets:
+        return
+
+    start_time = packets[0].timestamp
+    for packet in packets:
+        line = (
+            f"{packet.timestamp - start_time:10.6f} {packet.address} "
+            f"{str(packet.kind):<17} {packet.describe()}"
+        )
+        if args.hex:
+            line += f" [{packet.data.hex(' ')}]"
+        print(line)
+
+    if args.images_folder is not None:
+        for index, (packet, image_data) in enumerate(replay_transfers(packets)):
+            name = f"{packet.address.replace(':', '')}-{index}"
+            data_path = path.join(args.images_folder, f"{name}.bin")
+            print(f"Writing {data_path}", file=sys.stderr)
+            with open(data_path, "wb") as data_file:
+                data_file.write(image_data)
+            try:
+                image = render_image(*decode_image(image_data, args.model))
+            except ValueError as e:
+                print(f"Failed to decode {data_path}: {e}", file=sys.stderr)
+                continue
+            image.save(path.join(args.images_folder, f"{name}.png"))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,221 @@
 import sys
+import json
+import time
 import asyncio
+import contextlib
 import argparse
 import logging
+from os import path
 from PIL import Image
-from gicisky_tag.encoder import encode_image, Dither
-from gicisky_tag.writer import send_data_to_screen
-from gicisky_tag.scanner import find_address
+from gicisky_tag.encoder import (
+    encode_image,
+    check_image_size,
+    compression_report,
+    Dither,
+    Compression,
+)
+from gicisky_tag.batch import encode_images
+from gicisky_tag.fleet import update_tags, UpdateResult
+from gicisky_tag.writer import Timeouts
+from gicisky_tag.scanner import (
+    find_device,
+    find_devices,
+    detect_model,
+    device_address,
+    tag_registry,
+)
+from gicisky_tag.models import MODELS, DEFAULT_MODEL
+from gicisky_tag.state import PayloadStore, ScanCache, SCAN_CACHE_TTL
+from gicisky_tag.capture import start_capture, stop_capture
 from gicisky_tag.log import logger
 
 
+def image_size_error(image_path, model):
+    """The `ValueError` raised if the image can't be encoded for `model`, or `None`."""
+    with Image.open(image_path) as image:
+        try:
+            check_image_size(image, model)
+        except ValueError as e:
+            return e
+    return None
+
+
 async def start(args):
-    logger.info("Loading image...")
-    # TODO: Retrieve the model of the tag (e.g. BWR or BW, screen size...) from the broadcasted BLE
-    # manufacturer data and adapt the image loading based on that.
-    image = Image.open(args.image)
-    image_data = encode_image(
-        image, dithering=args.dithering, debug_folder=args.debug_folder
-    )
+    if args.output_folder is None and len(args.image) > 1:
+        if args.address is None or len(args.address) != len(args.image):
+            raise SystemExit("Expected one --address for each --image")
+
+    # Scan before loading the images, to detect the model of the tags
+    addresses = args.address
+    scan_timeout = args.scan_timeout or None
+    scan_duration = None
+    if args.output_folder is None:
+        scan_start = time.perf_counter()
+        if args.address is None:
+            logger.info("Scanning...")
+            max_age = None if args.scan_cache is None else args.scan_cache_ttl
+            addresses = [await find_device(max_age=max_age)]
+            scan_duration = time.perf_counter() - scan_start
+        elif args.model is None and args.scan_timeout:
+            logger.info("Scanning...")
+            devices = find_devices(
+                args.address, args.scan_timeout, adapters=args.adapter
+            )
+            found_devices = {}
+            async with contextlib.aclosing(devices):
+                async for device in devices:
+                    found_devices[device.address.upper()] = device
+            scan_duration = time.perf_counter() - scan_start
+            # Connect to the devices found, without scanning again for the missing ones
+            addresses = [
+                found_devices.get(address.upper(), address) for address in addresses
+            ]
+            scan_timeout = None
 
-    if args.address is None:
-        logger.info("Scanning...")
-        address = await find_address()
+    # The model of each image to save, or of each tag to update
+    if args.output_folder is not None:
+        models = [args.model or DEFAULT_MODEL] * len(args.image)
+    elif args.model is not None:
+        models = [args.model] * len(addresses)
     else:
-        address = args.address
+        models = [detect_model(address) for address in addresses]
+
+    logger.info("Loading image...")
+    if len(args.image) == 1:
+        # A single image is sent to all the tags, encoded once for each of their models. The tags
+        # of a model with another screen size get the `ValueError` instead of the image data.
+        image = Image.open(args.image[0])
+        encoded_models = {}
+        for model in models:
+            if model not in encoded_models:
+                try:
+                    encoded_models[model] = encode_image(
+                        image,
+                        dithering=args.dithering,
+                        debug_folder=args.debug_folder,
+                        model=model,
+                        compression=args.compression,
+                    )
+                except ValueError as e:
+                    encoded_models[model] = e
+        encoded_images = [encoded_models[model] for model in models]
+        valid_models = [
+            model
+            for model, image_data in encoded_models.items()
+            if not isinstance(image_data, ValueError)
+        ]
+        if valid_models and logger.isEnabledFor(logging.DEBUG):
+            report = compression_report(
+                image, dithering=args.dithering, model=valid_models[0]
+            )
+            for compression, (size, saved) in report.items():
+                logger.debug(
+                    f"Compression {compression}: {size} bytes ({saved} bytes saved)"
+                )
+    else:
+        # The images that don't fit the screen of their model get the `ValueError` instead
+        errors = [
+            image_size_error(image_path, model)
+            for image_path, model in zip(args.image, models)
+        ]
+        valid_images = encode_images(
+            [
+                image_path
+                for image_path, error in zip(args.image, errors)
+                if error is None
+            ],
+            workers=args.workers,
+            dithering=args.dithering,
+            compression=args.compression,
+            models=[model for model, error in zip(models, errors) if error is None],
+        )
+        encoded_images = (error or next(valid_images) for error in errors)
+
+    if args.output_folder is not None:
+        failed = False
+        for image_path, image_data in zip(args.image, encoded_images):
+            if isinstance(image_data, ValueError):
+                logger.error(f"Failed to encode {image_path}: {image_data}")
+                failed = True
+                continue
+            data_path = path.join(
+                args.output_folder, path.splitext(path.basename(image_path))[0] + ".bin"
+            )
+            logger.info(f"Writing {data_path}")
+            with open(data_path, "wb") as data_file:
+                data_file.write(image_data)
+        if failed:
+            sys.exit(1)
+        logger.info("Done.")
+        return
+
+    # The tags whose image couldn't be encoded fail, without stopping the update of the others
+    results = [None] * len(addresses)
+    updates = []
+    for index, (address, image_data) in enumerate(zip(addresses, encoded_images)):
+        if isinstance(image_data, ValueError):
+            results[index] = UpdateResult(device_address(address), b"")
+            results[index].error = image_data
+        else:
+            updates.append((index, address, image_data))
+
+    with contextlib.ExitStack() as stack:
+        store = None
+        if args.state_file is not None:
+            store = stack.enter_context(PayloadStore(args.state_file))
+            if args.force:
+                for address in addresses:
+                    store.forget(device_address(address))
+        update_results = await update_tags(
+            [(address, image_data) for _, address, image_data in updates],
+            max_connections=args.max_connections,
+            adapters=args.adapter,
+            retries=args.retries,
+            store=store,
+            window=args.window,
+            reconnects=args.reconnects,
+            scan_timeout=scan_timeout,
+            timeouts=Timeouts(
+                block_size=args.request_timeout,
+                write_screen=args.request_timeout,
+                start_transfer=args.request_timeout,
+                block=args.request_timeout,
+                update=args.timeout,
+                request=args.request_timeout,
+            ),
+        )
+    for (index, _, _), result in zip(updates, update_results):
+        results[index] = result
 
-    await send_data_to_screen(address, image_data)
+    for result in results:
+        if scan_duration is not None:
+            result.metrics.record("scan", scan_duration)
+        logger.debug(f"Timings: {result.metrics}")
+    if args.metrics_file is not None:
+        with open(args.metrics_file, "a") as metrics_file:
+            for result in results:
+                metrics_file.write(json.dumps(result.to_dict()) + "\n")
 
+    failed = [result for result in results if not result.success]
+    for result in failed:
+        logger.error(f"Failed to update {result.address}: {result.error}")
+    if failed:
+        sys.exit(1)
     logger.info("Done.")
 
 
+async def run(args):
+    if args.scan_cache is None:
+        await start(args)
+        return
+    with ScanCache(args.scan_cache, ttl=args.scan_cache_ttl) as scan_cache:
+        scan_cache.load(tag_registry)
+        try:
+            await start(args)
+        finally:
+            scan_cache.save(tag_registry)
+
+
 def setup_logger(verbose=False):
     formatter = logging.Formatter(fmt="%(name)s (%(levelname)s): %(message)s")
     handler = logging.StreamHandler()
@@ -40,10 +227,20 @@ def setup_logger(verbose=False):
 
 def parser():
     parser = argparse.ArgumentParser(description="Write an image to a Gicisky tag.")
-    parser.add_argument("--image", type=str, help="Image to send.", required=True)
+    parser.add_argument(
+        "--image",
+        type=str,
+        nargs="+",
+        help=(
+            "Image to send. A single image is sent to all the tags, "
+            "multiple images are sent to the tags of the matching addresses."
+        ),
+        required=True,
+    )
     parser.add_argument(
         "--address",
         type=str,
+        nargs="+",
         help=(
             "Bluetooth address of the Gicisky tag to be updated. "
             "If not provided, the script will scan and use the first Gicisky tag that it can find."
@@ -56,9 +253,144 @@ def parser():
         default=Dither.NONE,
         help=f"Dithering method (default: {Dither.NONE}).",
     )
+    parser.add_argument(
+        "--compression",
+        type=Compression,
+        choices=list(Compression),
+        default=Compression.FAST,
+        help=f"Compression level of the image data (default: {Compression.FAST}).",
+    )
+    parser.add_argument(
+        "--model",
+        choices=list(MODELS),
+        help=(
+            "Model of the Gicisky tag. By default, the model is detected from the advertisements "
+            f"of the tag, falling back to {DEFAULT_MODEL}."
+        ),
+    )
+    parser.add_argument(
+        "--output-folder",
+        type=str,
+        help=(
+            "Folder in which to save the encoded image data, one .bin file per image, "
+            "instead of sending it."
+        ),
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of processes used to encode multiple images (default: one per core).",
+    )
+    parser.add_argument(
+        "--window",
+        type=int,
+        help=(
+            "Number of image blocks to send ahead of the requests of the tag, without waiting for "
+            "write responses. If the tag loses a block, the transfer sends one block at a time "
+            "until the tag catches up. By default, one block is sent at a time."
+        ),
+    )
+    parser.add_argument(
+        "--max-connections",
+        type=int,
+        default=3,
+        help="Maximum number of tags updated at the same time on each adapter (default: 3).",
+    )
+    parser.add_argument(
+        "--adapter",
+        type=str,
+        nargs="+",
+        help="Bluetooth adapters to use to update the tags, e.g. hci0 (default: the system default).",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=0,
+        help="Number of times a failed update is retried (default: 0).",
+    )
+    parser.add_argument(
+        "--reconnects",
+        type=int,
+        default=2,
+        help=(
+            "Number of times to reconnect to a tag after losing the connection during an update, "
+            "resuming the transfer where the tag left it (default: 2)."
+        ),
+    )
+    parser.add_argument(
+        "--scan-timeout",
+        type=float,
+        default=10,
+        help=(
+            "Maximum time to scan for the tags before connecting to them, in seconds. The update "
+            "of each tag starts as soon as it's found. Use 0 to connect without scanning first "
+            "(default: 10)."
+        ),
+    )
+    parser.add_argument(
+        "--scan-cache",
+        type=str,
+        help=(
+            "File in which to remember the tags seen by the scanner (address, model, MTU), "
+            "to skip scanning for them in the next runs."
+        ),
+    )
+    parser.add_argument(
+        "--scan-cache-ttl",
+        type=float,
+        default=SCAN_CACHE_TTL,
+        help=(
+            "Time for which the tags remembered in the scan cache are used, in seconds "
+            f"(default: {SCAN_CACHE_TTL:.0f})."
+        ),
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=120.0,
+        help="Maximum time for the update of each tag, in seconds (default: 120).",
+    )
+    parser.add_argument(
+        "--request-timeout",
+        type=float,
+        default=5.0,
+        help=(
+            "Maximum time to wait for the tag to answer each request or to request each image block, "
+            "in seconds (default: 5)."
+        ),
+    )
+    parser.add_argument(
+        "--metrics-file",
+        type=str,
+        help=(
+            "File to which to append the outcome and the timings of the update of each tag, "
+            "as JSON lines."
+        ),
+    )
+    parser.add_argument(
+        "--capture-file",
+        type=str,
+        help=(
+            "File to which to append the packets exchanged with the tags. "
+            "Run gicisky-capture to print them."
+        ),
+    )
     parser.add_argument(
         "--debug-folder", type=str, help="Folder in which to save debug data."
     )
+    parser.add_argument(
+        "--state-file",
+        type=str,
+        help=(
+            "File in which to remember the image last sent to each tag. "
+            "If provided, the update is skipped when the tag already shows the same image."
+        ),
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Update the tag even if the state file says that the image is unchanged.",
+    )
     parser.add_argument(
         "-v", "--verbose", action="store_true", help="Enable verbose logging"
     )
@@ -68,7 +400,12 @@ def parser():
 def main():
     args = parser().parse_args()
     setup_logger(args.verbose)
-    asyncio.run(start(args))
+    if args.capture_file is not None:
+        start_capture(args.capture_file)
+    try:
+        asyncio.run(run(args))
+    finally:
+        stop_capture()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,194 @@
+import asyncio
+import contextlib
+from bleak.exc import BleakError
+from gicisky_tag.writer import (
+    ScreenWriter,
+    acquire_mtu,
+    connect_client,
+    write_image_resumable,
+)
+from gicisky_tag.metrics import TransferMetrics
+from gicisky_tag.scanner import device_address
+from gicisky_tag.log import logger
+
+
+class GiciskyClient:
+    """
+    Long-lived connection to a tag, reused by several updates.
+
+    Connecting, acquiring the MTU and subscribing to the notifications of the tag are done once per
+    connection instead of once per update, which makes frequent updates of the same tag much faster.
+    The connection is opened by the first update, reopened on demand if it drops, and closed once it
+    has been idle for `idle_timeout` seconds. Use it as an async context manager to close it at the
+    end:
+
+        async with GiciskyClient(address) as client:
+            await client.send(image_data)
+            ...
+            await client.send(other_image_data)
+
+    Attributes:
+    - address: The Bluetooth address of the tag. A `BLEDevice` can be passed instead, to connect
+      without scanning for the tag first, see `connect_to_tag`.
+    - adapter: The Bluetooth adapter to use, see `connect_to_tag`.
+    - idle_timeout: Time after which an unused connection is closed, in seconds, or `None` to keep
+      it open until `close` is called.
+    - window, reconnects, reconnect_delay, timeouts, store: See `send_data_to_screen`.
+    - device: The `BleakClient` of the tag, or a stand-in like a `SimulatedTag`. If provided, its
+      disconnections must be reported to `disconnected`.
+    """
+
+    def __init__(
+        self,
+        address,
+        adapter=None,
+        idle_timeout=60.0,
+        window=None,
+        reconnects=2,
+        reconnect_delay=1.0,
+        timeouts=None,
+        store=None,
+        device=None,
+    ):
+        assert idle_timeout is None or idle_timeout > 0
+        self.address = device_address(address)
+        self.ble_device = address
+        self.adapter = adapter
+        self.idle_timeout = idle_timeout
+        self.window = window
+        self.reconnects = reconnects
+        self.reconnect_delay = reconnect_delay
+        self.timeouts = timeouts
+        self.store = store
+        self.device = device
+        self.owns_device = device is None
+        # The `ScreenWriter` of the ongoing update, which receives the notifications of the tag
+        self.screen = None
+        # Updates and disconnections are done one at a time
+        self.lock = asyncio.Lock()
+        self.idle_task = None
+        self.idle_deadline = None
+
+    def __repr__(self):
+        state = "connected" if self.is_connected else "disconnected"
+        return f"GiciskyClient({self.address}, {state})"
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    @property
+    def is_connected(self):
+        return self.device is not None and self.device.is_connected
+
+    def disconnected(self, device):
+        logger.info(f"Disconnected from {self.address}")
+        if self.screen is not None:
+            self.screen.disconnected(device)
+
+    async def forward_notification(self, sender, data):
+        if self.screen is not None:
+            await self.screen.handle_notification(sender, data)
+
+    async def connect(self, metrics=None):
+        """Connect to the tag and subscribe to its notifications, unless already connected."""
+        if self.is_connected:
+            return
+        metrics = TransferMetrics(self.address) if metrics is None else metrics
+        if self.owns_device:
+            self.device = await connect_client(
+                self.ble_device, self.adapter, self.disconnected, metrics
+            )
+        else:
+            logger.info(f"Connecting to {self.address}...")
+            with metrics.measure("connect"):
+                await self.device.connect()
+        try:
+            await acquire_mtu(self.device, metrics)
+            await self.device.start_notify(
+                ScreenWriter.REQUEST_CHARACTERISTIC, self.forward_notification
+            )
+        except BaseException:
+            await self.device.disconnect()
+            raise
+        self.touch()
+        if self.idle_timeout is not None and (
+            self.idle_task is None or self.idle_task.done()
+        ):
+            self.idle_task = asyncio.create_task(self.close_when_idle())
+
+    async def disconnect(self):
+        if not self.is_connected:
+            return
+        logger.info(f"Disconnecting from {self.address}")
+        try:
+            await self.device.stop_notify(ScreenWriter.REQUEST_CHARACTERISTIC)
+        except BleakError as e:
+            logger.debug(f"Failed to stop the notifications of {self.address}: {e}")
+        await self.device.disconnect()
+
+    async def close(self):
+        """Close the connection, if open. A later update opens it again."""
+        async with self.lock:
+            await self.disconnect()
+        if self.idle_task is not None:
+            self.idle_task.cancel()
+            self.idle_task = None
+
+    def touch(self):
+        """Postpone the closing of the idle connection."""
+        if self.idle_timeout is not None:
+            self.idle_deadline = asyncio.get_running_loop().time() + self.idle_timeout
+
+    async def close_when_idle(self):
+        loop = asyncio.get_running_loop()
+        while self.is_connected:
+            await asyncio.sleep(max(self.idle_deadline - loop.time(), 0))
+            async with self.lock:
+                if self.is_connected and loop.time() >= self.idle_deadline:
+                    logger.info(f"Closing the idle connection to {self.address}")
+                    await self.disconnect()
+
+    @contextlib.asynccontextmanager
+    async def connection(self, screen):
+        """Yield the open connection for the update of `screen`, closing it if the update fails."""
+        self.screen = screen
+        try:
+            await self.connect(screen.metrics)
+            yield self.device
+        except BaseException:
+            await self.disconnect()
+            raise
+        finally:
+            self.screen = None
+            self.touch()
+
+    async def send(self, image_data, metrics=None):
+        """Send the encoded image data to the tag, like `send_data_to_screen`.
+
+        Returns whether the image data has been sent. The timings of the update are recorded in
+        `metrics`, if provided.
+        """
+        if self.store is not None and self.store.is_unchanged(self.address, image_data):
+            logger.info(
+                f"The image of {self.address} is unchanged, skipping the update."
+            )
+            return False
+
+        async with self.lock:
+            await write_image_resumable(
+                self.connection,
+                image_data,
+                window=self.window,
+                reconnects=self.reconnects,
+                reconnect_delay=self.reconnect_delay,
+                timeouts=self.timeouts,
+                metrics=TransferMetrics(self.address) if metrics is None else metrics,
+                subscribe=False,
+            )
+
+        if self.store is not None:
+            self.store.record(self.address, image_data)
+        return True
@@ -0,0 +1,126 @@
+import functools
+import numpy as np
+from PIL import Image
+from gicisky_tag.encoder import black_color, white_color, red_color
+from gicisky_tag.models import DEFAULT_MODEL, get_model
+
+# Number of tokens (bytes or markers) of a line that are covered by the marker bit pattern
+PATTERN_BITS = 32
+
+
+def decode_repeat_marker(line, index):
+    """Decode the repeat marker at `line[index]`, returning the repeat count and the marker size."""
+    if line[index : index + 2] == b"\x00\x00" and index + 2 < len(line):
+        return line[index + 2], 3
+    if 0 < line[index] <= 0x0F and line[index + 1 : index + 2] == b"\x00":
+        return line[index] + 2, 2
+    raise ValueError(
+        f"Unknown compression marker at byte {index}: {line[index : index + 3].hex()}"
+    )
+
+
+@functools.lru_cache(maxsize=4096)
+def decode_line(line):
+    """Decode an encoded line, given as `bytes` including its header, into the uncompressed bytes.
+
+    The semantics of the markers are the ones of `docs/Cabalist_notes/utils/decompress.py`: the first
+    marker of a line repeats the byte on its left, unless it's followed by another marker, while the
+    following markers add repetitions to the byte on their right.
+    """
+    if len(line) < 7 or line[0] != 0x75 or line[1] != len(line):
+        raise ValueError(f"Invalid line header: {line[:7].hex()}")
+    num_line_bytes = line[2]
+    pattern = int.from_bytes(line[3:7], "little")
+    if pattern == 0:
+        if len(line) - 7 != num_line_bytes:
+            raise ValueError(
+                f"Uncompressed line has {len(line) - 7} bytes, but should have {num_line_bytes}"
+            )
+        return line[7:]
+
+    decoded_line = bytearray()
+    pending_repeats = 0
+    first_marker = True
+    index = 7
+    token = 0
+    while index < len(line):
+        if token < PATTERN_BITS and (pattern >> token) & 1:
+            count, marker_size = decode_repeat_marker(line, index)
+            index += marker_size
+            token += 1
+            next_is_data = index < len(line) and not (
+                token < PATTERN_BITS and (pattern >> token) & 1
+            )
+            if first_marker and next_is_data:
+                decoded_line += (
+                    decoded_line[-1:] * count if decoded_line else bytes(count)
+                )
+            else:
+                pending_repeats += count
+            first_marker = False
+        else:
+            decoded_line += line[index : index + 1] * (pending_repeats + 1)
+            pending_repeats = 0
+            index += 1
+            token += 1
+
+    if pending_repeats:
+        raise ValueError("The line ends with a compression marker")
+    if len(decoded_line) != num_line_bytes:
+        raise ValueError(
+            f"Decoded line has {len(decoded_line)} bytes, but should have {num_line_bytes}"
+        )
+    return bytes(decoded_line)
+
+
+def split_lines(image_data):
+    """Split the encoded image data, including the 4-byte length prefix, into encoded lines.
+
+    The prefix isn't checked: the captures of the official app carry the size of an uncompressed
+    color plane there, instead of the size of the image data.
+    """
+    # Slicing `bytes` is much faster than slicing a `memoryview` and converting each line
+    image_data = bytes(image_data)
+    # Lines are validated by `decode_line`, including the ones that are truncated
+    lines = []
+    index = 4
+    while index + 1 < len(image_data):
+        line_size = max(image_data[index + 1], 1)
+        lines.append(image_data[index : index + line_size])
+        index += line_size
+    if index < len(image_data):
+        lines.append(image_data[index:])
+    return lines
+
+
+def decode_image(image_data, model=DEFAULT_MODEL):
+    """Decode the image data produced by `encode_image` (or by the official app) for `model`.
+
+    Returns the black/white and the red bitmaps, as boolean arrays of shape `(height, width)`. In the
+    black/white bitmap `True` means white, in the red bitmap `True` means red. The red bitmap is
+    empty for models without red.
+    """
+    model = get_model(model)
+    decoded_lines = [decode_line(line) for line in split_lines(image_data)]
+    expected_sizes = model.line_sizes * model.num_planes
+    if tuple(map(len, decoded_lines)) != expected_sizes:
+        raise ValueError(
+            f"The lines of the image data don't match the layout of model {model}"
+        )
+
+    # The extra pixel at the end of each plane collects the padding of `model.pixel_indices`
+    planes = np.frombuffer(b"".join(decoded_lines), dtype=np.uint8)
+    bits = np.unpackbits(planes.reshape(model.num_planes, -1), axis=-1)
+    pixels = np.zeros((2, model.width * model.height + 1), dtype=bool)
+    pixels[: model.num_planes, model.pixel_indices] = bits
+    bitmaps = pixels[:, :-1].reshape(2, model.height, model.width)
+    return bitmaps[0], bitmaps[1]
+
+
+def render_image(bw_bitmap, red_bitmap):
+    """Render the decoded bitmaps as an RGB image, as they would look on the screen."""
+    pixels = np.empty((*bw_bitmap.shape, 3), dtype=np.uint8)
+    pixels[:] = black_color
+    pixels[bw_bitmap] = white_color
+    pixels[red_bitmap] = red_color
+    return Image.fromarray(pixels, "RGB")
@@ -1,9 +1,12 @@
 import math
+import functools
+import itertools
 from enum import Enum
 from PIL import Image
 import numpy as np
 from os import path
 from gicisky_tag.log import logger
+from gicisky_tag.models import DEFAULT_MODEL, get_model
 
 black_color = [0, 0, 0]  # [47, 36, 41]
 white_color = [255, 255, 255]  # [242, 244, 239]
@@ -15,6 +18,17 @@ green_color = [0, 255, 0]
 yellow_color = [255, 255, 0]
 magenta_color = [255, 0, 255]
 
+# Palette of the dithered images, and indices of its colors
+bwr_palette = black_color + white_color + red_color
+BLACK, WHITE, RED = range(3)
+# For each color plane of the image data (black/white, red), the bit of each color of `bwr_palette`
+plane_lookup = np.array([[False, True, False], [False, False, True]])
+
+# The official app sets this bit of the marker bit pattern on all the lines that it compresses.
+COMPRESSED_LINE_FLAG = 1 << 31
+# Maximum number of tokens (bytes or markers) in a compressed line, see `COMPRESSED_LINE_FLAG`.
+COMPRESSED_LINE_MAX_TOKENS = 31
+
 
 def quantize_image_simple_colors(image, debug_folder=None):
     """Quantize the image to simple colors."""
@@ -50,24 +64,148 @@ class Dither(Enum):
     * COMBINED: quantize grayscale and red colors independently using Floyd-Steinberg dithering,
         then combine them. This usually limits the usage of red to the areas where it is really
         needed.
+    * BAYER: ordered dithering with a Bayer threshold matrix. Much faster than Floyd-Steinberg, and
+        the result of each pixel only depends on its color and position, so unchanged regions of
+        an image stay unchanged.
+    * BLUE_NOISE: like BAYER, but with a blue noise threshold matrix, which has less visible
+        patterns.
     """
 
     NONE = "none"
     FLOYDSTEINBERG = "floydsteinberg"
     COMBINED = "combined"
+    BAYER = "bayer"
+    BLUE_NOISE = "bluenoise"
 
     def __str__(self):
         return self.value
 
 
-def dither_image_bwr(image, dithering, debug_folder=None):
-    """Dither the image using black, white and red."""
+class Compression(Enum):
+    """Compression level of the image data.
+
+    Possible values:
+    * NONE: send all the lines uncompressed.
+    * FAST: compress each line placing the repeat markers greedily.
+    * MAX: compress each line choosing the placement of the repeat markers that minimizes its size.
+        This is much slower than FAST, but the result is never bigger.
+    """
+
+    NONE = "none"
+    FAST = "fast"
+    MAX = "max"
+
+    def __str__(self):
+        return self.value
+
+
+def bayer_matrix(size=8):
+    """Ranks, from 0 to `size * size - 1`, of a Bayer threshold matrix."""
+    assert size > 0 and size & (size - 1) == 0, "The size must be a power of two"
+    ranks = np.zeros((1, 1), dtype=np.intp)
+    while len(ranks) < size:
+        ranks = np.block([[4 * ranks, 4 * ranks + 2], [4 * ranks + 3, 4 * ranks + 1]])
+    return ranks
+
+
+@functools.cache
+def blue_noise_matrix(size=64, sigma=1.5):
+    """Ranks, from 0 to `size * size - 1`, of a blue noise threshold matrix.
+
+    The matrix is computed with the void-and-cluster method, which repeatedly looks for the tightest
+    cluster of set pixels or the largest void of unset pixels by measuring how close each pixel is
+    to the set pixels with a Gaussian filter that wraps around the edges.
+    """
+    num_pixels = size * size
+    distances = np.minimum(np.arange(size), size - np.arange(size))
+    kernel = np.exp(
+        -(distances[:, np.newaxis] ** 2 + distances[np.newaxis, :] ** 2)
+        / (2 * sigma**2)
+    )
+
+    def toggle(pattern, energy, pixel):
+        pattern.flat[pixel] = not pattern.flat[pixel]
+        sign = 1 if pattern.flat[pixel] else -1
+        energy += sign * np.roll(kernel, divmod(pixel, size), axis=(0, 1))
+
+    def tightest_cluster(pattern, energy):
+        return np.argmax(np.where(pattern, energy, -np.inf))
+
+    def largest_void(pattern, energy):
+        return np.argmin(np.where(pattern, np.inf, energy))
+
+    # Start from a random pattern, then move pixels from clusters to voids until it's uniform
+    rng = np.random.default_rng(0)
+    pattern = np.zeros((size, size), dtype=bool)
+    pattern.flat[rng.choice(num_pixels, num_pixels // 10, replace=False)] = True
+    energy = np.real(np.fft.ifft2(np.fft.fft2(pattern) * np.fft.fft2(kernel)))
+    for _ in range(num_pixels):
+        cluster = tightest_cluster(pattern, energy)
+        toggle(pattern, energy, cluster)
+        void = largest_void(pattern, energy)
+        toggle(pattern, energy, void)
+        if void == cluster:
+            break
+
+    ranks = np.zeros((size, size), dtype=np.intp)
+    num_initial_pixels = np.count_nonzero(pattern)
+    initial_pattern, initial_energy = pattern.copy(), energy.copy()
+    for rank in range(num_initial_pixels - 1, -1, -1):
+        cluster = tightest_cluster(pattern, energy)
+        toggle(pattern, energy, cluster)
+        ranks.flat[cluster] = rank
+    pattern, energy = initial_pattern, initial_energy
+    for rank in range(num_initial_pixels, num_pixels):
+        void = largest_void(pattern, energy)
+        toggle(pattern, energy, void)
+        ranks.flat[void] = rank
+    return ranks
+
+
+@functools.lru_cache(maxsize=16)
+def threshold_map(dithering, height, width):
+    """Thresholds, from 0 to 254, of the ordered `dithering` method for an image of the given size.
+
+    The threshold matrix is tiled to cover the whole image, so the threshold of each pixel only
+    depends on its position.
+    """
+    if dithering == Dither.BAYER:
+        ranks = bayer_matrix()
+    elif dithering == Dither.BLUE_NOISE:
+        ranks = blue_noise_matrix()
+    else:
+        raise ValueError(f"Not an ordered dithering method: {dithering}")
+    thresholds = ((2 * ranks + 1) * 255 // (2 * ranks.size)).astype(np.int16)
+    repeats = (math.ceil(height / len(ranks)), math.ceil(width / len(ranks)))
+    thresholds = np.tile(thresholds, repeats)[:height, :width]
+    thresholds.flags.writeable = False
+    return thresholds
+
+
+def palette_lookup(palette_image):
+    """Map each palette index of a "P" image to the index of its color in `bwr_palette`.
+
+    Colors that are neither white nor red are mapped to black.
+    """
+    palette = np.array(palette_image.getpalette(), dtype=np.uint8).reshape(-1, 3)
+    lookup = np.full(256, BLACK, dtype=np.uint8)
+    lookup[: len(palette)][(palette == white_color).all(axis=-1)] = WHITE
+    lookup[: len(palette)][(palette == red_color).all(axis=-1)] = RED
+    return lookup
+
+
+def dither_bwr_indices(image, dithering, debug_folder=None):
+    """Dither the image using black, white and red.
+
+    Returns a `uint8` array of shape `(height, width)` with the index in `bwr_palette` of the color
+    of each pixel.
+    """
     if dithering not in Dither:
         raise ValueError(f"Invalid dithering parameter: {dithering}")
 
     if dithering in (Dither.NONE, Dither.FLOYDSTEINBERG):
         bwr_palette_image = Image.new("P", (1, 1))
-        bwr_palette_image.putpalette(black_color + white_color + red_color)
+        bwr_palette_image.putpalette(bwr_palette)
         quant_image = image.convert("RGB").quantize(
             palette=bwr_palette_image,
             dither=Image.NONE if dithering == Dither.NONE else Image.FLOYDSTEINBERG,
@@ -76,29 +214,24 @@ def dither_image_bwr(image, dithering, debug_folder=None):
         if debug_folder is not None:
             quant_image.save(path.join(debug_folder, "quant_image.png"))
 
-        return quant_image
+        return palette_lookup(quant_image)[np.asarray(quant_image)]
 
     elif dithering == Dither.COMBINED:
-        quant_image = quantize_image_simple_colors(
-            image, debug_folder=debug_folder
-        ).convert("RGB")
+        quant_image = quantize_image_simple_colors(image, debug_folder=debug_folder)
 
         bw_image = image.convert("1")
-        bw_bitmap = np.asarray(bw_image).astype(bool)
+        bw_bitmap = np.asarray(bw_image)
         assert (
             bw_bitmap.shape == image.size[::-1]
         ), f"Expected shape {image.size[::-1]}, but got {bw_bitmap.shape}"
 
-        red_bitmap = (np.asarray(quant_image) == red_color).all(axis=-1)
+        red_bitmap = palette_lookup(quant_image)[np.asarray(quant_image)] == RED
         assert (
             red_bitmap.shape == image.size[::-1]
         ), f"Expected shape {image.size[::-1]}, but got {red_bitmap.shape}"
 
-        bwr_pixels = np.zeros((*image.size[::-1], 3), dtype=np.uint8)
-        bwr_pixels[red_bitmap] = red_color
-        bwr_pixels[(red_bitmap == False) & bw_bitmap] = white_color
-        bwr_pixels[(red_bitmap == False) & (bw_bitmap == False)] = black_color
-        bwr_image = Image.fromarray(bwr_pixels, "RGB")
+        bwr_indices = bw_bitmap.astype(np.uint8)  # WHITE or BLACK
+        bwr_indices[red_bitmap] = RED
 
         if debug_folder is not None:
             bw_image.save(path.join(debug_folder, "bw_image.png"))
@@ -108,58 +241,394 @@ def dither_image_bwr(image, dithering, debug_folder=None):
             Image.fromarray(np.uint8(red_bitmap * 255), "L").save(
                 path.join(debug_folder, "red_bitmap.png")
             )
-            bwr_image.save(path.join(debug_folder, "bwr_image.png"))
+            bwr_indices_to_image(bwr_indices).save(
+                path.join(debug_folder, "bwr_image.png")
+            )
+
+        return bwr_indices
+
+    elif dithering in (Dither.BAYER, Dither.BLUE_NOISE):
+        # Split the color of each pixel into a share of red, of white and of black, then pick one
+        # of them comparing the cumulative shares with the threshold of the pixel.
+        rgb_image = image.convert("RGB")
+        red, green, blue = (
+            np.asarray(rgb_image.getchannel(channel), dtype=np.int16)
+            for channel in "RGB"
+        )
+        white_share = green + blue
+        white_share //= 2
+        red_share = red - white_share
+        np.maximum(red_share, 0, out=red_share)
+        thresholds = threshold_map(dithering, *red.shape)
+
+        red_bitmap = thresholds < red_share
+        red_share += white_share
+        bwr_indices = np.less(thresholds, red_share).view(np.uint8)  # WHITE or BLACK
+        bwr_indices[red_bitmap] = RED
+
+        if debug_folder is not None:
+            Image.fromarray(np.uint8(red_bitmap * 255), "L").save(
+                path.join(debug_folder, "red_bitmap.png")
+            )
+            bwr_indices_to_image(bwr_indices).save(
+                path.join(debug_folder, "bwr_image.png")
+            )
+
+        return bwr_indices
+
+
+def dither_bw_indices(image, dithering, debug_folder=None):
+    """Dither the image using black and white.
+
+    Returns a `uint8` array of shape `(height, width)` with the index in `bwr_palette` of the color
+    of each pixel.
+    """
+    if dithering not in Dither:
+        raise ValueError(f"Invalid dithering parameter: {dithering}")
+
+    if dithering in (Dither.BAYER, Dither.BLUE_NOISE):
+        gray = np.asarray(image.convert("L"))
+        bw_image = Image.fromarray(gray > threshold_map(dithering, *gray.shape))
+    else:
+        bw_image = image.convert(
+            "1",
+            dither=Image.NONE if dithering == Dither.NONE else Image.FLOYDSTEINBERG,
+        )
+
+    if debug_folder is not None:
+        bw_image.save(path.join(debug_folder, "bw_image.png"))
+
+    return np.asarray(bw_image).astype(np.uint8)  # WHITE or BLACK
+
+
+def bwr_indices_to_image(bwr_indices):
+    """Convert an array of indices in `bwr_palette` to a "P" image."""
+    bwr_image = Image.fromarray(bwr_indices, "P")
+    bwr_image.putpalette(bwr_palette)
+    return bwr_image
 
-        return bwr_image
 
+def dither_image_bwr(image, dithering, debug_folder=None):
+    """Dither the image using black, white and red."""
+    return bwr_indices_to_image(
+        dither_bwr_indices(image, dithering, debug_folder=debug_folder)
+    )
 
-def encode_image(image, dithering=Dither.NONE, debug_folder=None):
-    bwr_image = dither_image_bwr(image, dithering=dithering, debug_folder=debug_folder)
-    bwr_pixels = np.asarray(bwr_image.convert("RGB")).astype(int)
 
-    bw_bitmap = (bwr_pixels == white_color).all(axis=-1)
-    bw_bitmap = np.flipud(np.rot90(bw_bitmap))
-    assert (
-        bw_bitmap.shape == image.size
-    ), f"Expected shape {image.size}, but got {bw_bitmap.shape}"
+def check_image_size(image, model=DEFAULT_MODEL):
+    """Raise a `ValueError` if the size of `image` isn't the screen size of `model`."""
+    model = get_model(model)
+    if image.size != model.size:
+        raise ValueError(
+            f"Expected image of size {model.size} for model {model}, but got {image.size}"
+        )
 
-    red_bitmap = (bwr_pixels == red_color).all(axis=-1)
-    red_bitmap = np.flipud(np.rot90(red_bitmap))
-    assert (
-        red_bitmap.shape == image.size
-    ), f"Expected shape {image.size}, but got {red_bitmap.shape}"
 
-    bw_data = compress_bitmap(np.packbits(bw_bitmap, axis=-1), image.size)
-    red_data = compress_bitmap(np.packbits(red_bitmap, axis=-1), image.size)
+def encode_image(
+    image,
+    dithering=Dither.NONE,
+    debug_folder=None,
+    model=DEFAULT_MODEL,
+    compression=Compression.FAST,
+):
+    model = get_model(model)
+    check_image_size(image, model)
+
+    if model.red:
+        bwr_indices = dither_bwr_indices(
+            image, dithering=dithering, debug_folder=debug_folder
+        )
+    else:
+        bwr_indices = dither_bw_indices(
+            image, dithering=dithering, debug_folder=debug_folder
+        )
+
+    # The extra black pixel at the end is the padding used by `model.pixel_indices`
+    colors = np.zeros(bwr_indices.size + 1, dtype=np.uint8)
+    colors[:-1] = bwr_indices.reshape(-1)
+    colors = colors[model.pixel_indices]
+    bits = np.empty((model.num_planes, colors.size), dtype=bool)
+    for plane in range(model.num_planes):
+        np.take(plane_lookup[plane], colors, out=bits[plane])
+    planes = np.packbits(bits).reshape(model.num_planes, -1)
 
-    image_data = bytearray(bw_data) + bytearray(red_data)
-    image_data = len(image_data).to_bytes(4, "little") + image_data
+    image_data = encode_lines(
+        model.split_planes(planes), prefix_size=4, compression=compression
+    )
+    image_data[:4] = model.size_prefix(len(image_data) - 4).to_bytes(4, "little")
     return image_data
 
 
-def compress_bitmap(bitmap, image_shape):
-    expected_shape = (250, 122)
-    # TODO: make sure that the compression works well for other image sizes
-    assert (
-        image_shape == expected_shape
-    ), f"Expected image of shape {expected_shape}, but got {image_shape}"
+def compression_report(image, dithering=Dither.NONE, model=DEFAULT_MODEL):
+    """Encode the image with each compression level.
+
+    Returns a dictionary that maps each `Compression` level to the size of the image data and to the
+    number of bytes saved compared to `Compression.NONE`.
+    """
+    sizes = {
+        compression: len(
+            encode_image(
+                image, dithering=dithering, model=model, compression=compression
+            )
+        )
+        for compression in Compression
+    }
+    return {
+        compression: (size, sizes[Compression.NONE] - size)
+        for compression, size in sizes.items()
+    }
+
+
+def encode_repeat_marker(count):
+    """Encode a marker that repeats a byte `count` times.
+
+    Two-byte markers cover counts from 3 to 17, while three-byte markers start with two zero bytes
+    and cover any count that fits in a byte. See `docs/Cabalist_notes/utils/decompress.py`.
+    """
+    assert 0 < count <= 255
+    if 3 <= count <= 17:
+        return [count - 2, 0x00]
+    return [0x00, 0x00, count]
+
+
+def compress_line(line):
+    """Compress the bytes of a line using repeat markers.
+
+    Returns the marker bit pattern and the encoded bytes, or `None` if the line doesn't benefit from
+    compression. The first marker of a line repeats the byte on its left, while the following
+    markers add repetitions to the byte on their right. Lines that would need more than 31 tokens
+    (bytes or markers) are left uncompressed, because the official app always sets the last bit of
+    the pattern on compressed lines.
+    """
+    runs = [(value, len(list(group))) for value, group in itertools.groupby(line)]
+    pattern = 0
+    num_tokens = 0
+    encoded_line = []
+    last_token_is_first_marker = False
 
+    def push_data(value, count=1):
+        nonlocal num_tokens, last_token_is_first_marker
+        encoded_line.extend([value] * count)
+        num_tokens += count
+        last_token_is_first_marker = False
+
+    def push_marker(count):
+        nonlocal pattern, num_tokens, last_token_is_first_marker
+        last_token_is_first_marker = pattern == 0
+        pattern |= 1 << num_tokens
+        encoded_line.extend(encode_repeat_marker(count))
+        num_tokens += 1
+
+    for index, (value, length) in enumerate(runs):
+        is_last_run = index == len(runs) - 1
+        if pattern == 0:
+            # The first marker repeats the byte on its left and must be followed by some data
+            repeats = length - 2 if is_last_run else length - 1
+            repeat_right = is_last_run
+        elif last_token_is_first_marker:
+            # A marker right after the first one would make the first one repeat on the right
+            repeats = length - 2
+            repeat_right = True
+        else:
+            repeats = length - 1
+            repeat_right = False
+        if repeats <= 0 or len(encode_repeat_marker(repeats)) >= repeats:
+            push_data(value, length)
+        elif pattern == 0:
+            push_data(value)
+            push_marker(repeats)
+            if repeat_right:
+                push_data(value)
+        elif repeat_right:
+            push_data(value)
+            push_marker(repeats)
+            push_data(value)
+        else:
+            push_marker(repeats)
+            push_data(value)
+
+    if pattern == 0 or num_tokens > COMPRESSED_LINE_MAX_TOKENS:
+        return None
+    return pattern | COMPRESSED_LINE_FLAG, encoded_line
+
+
+def compress_line_optimal(line):
+    """Like `compress_line`, but choosing the placement of the markers that minimizes the size.
+
+    The placement is computed by dynamic programming over the position in the line, the number of
+    tokens used so far and whether the first marker has been placed, and if so whether it has
+    already been followed by some data.
+    """
+    no_marker, after_first_marker, free = range(3)
+    # Number of bytes equal to `line[i]` starting from `line[i]`
+    run_lengths = [1] * len(line)
+    for i in range(len(line) - 2, -1, -1):
+        if line[i] == line[i + 1]:
+            run_lengths[i] = run_lengths[i + 1] + 1
+
+    # For each position, map each (phase, tokens) to the minimum size and the step that reached it
+    states = [{} for _ in range(len(line) + 1)]
+    states[0][(no_marker, 0)] = (0, None)
+
+    def relax(position, phase, num_tokens, size, step):
+        previous = states[position].get((phase, num_tokens))
+        if previous is None or size < previous[0]:
+            states[position][(phase, num_tokens)] = (size, step)
+
+    for i in range(len(line)):
+        # Skip the states that use more tokens than another state of the same phase and size
+        min_sizes = {}
+        for (phase, num_tokens), (size, _) in sorted(
+            states[i].items(), key=lambda item: item[0][1]
+        ):
+            if size >= min_sizes.get(phase, size + 1):
+                continue
+            min_sizes[phase] = size
+            step = (i, phase, num_tokens)
+            if num_tokens >= COMPRESSED_LINE_MAX_TOKENS:
+                continue
+            next_phase = no_marker if phase == no_marker else free
+            relax(i + 1, next_phase, num_tokens + 1, size + 1, step + (0,))
+            if phase == no_marker and i > 0 and line[i] == line[i - 1]:
+                # The first marker, repeating the byte on its left
+                for count in range(1, min(run_lengths[i], 255) + 1):
+                    marker_size = len(encode_repeat_marker(count))
+                    relax(
+                        i + count,
+                        after_first_marker,
+                        num_tokens + 1,
+                        size + marker_size,
+                        step + (count,),
+                    )
+            elif phase == free and num_tokens + 2 <= COMPRESSED_LINE_MAX_TOKENS:
+                # A marker followed by the byte that it repeats
+                for count in range(1, min(run_lengths[i] - 1, 255) + 1):
+                    marker_size = len(encode_repeat_marker(count))
+                    relax(
+                        i + count + 1,
+                        free,
+                        num_tokens + 2,
+                        size + marker_size + 1,
+                        step + (count,),
+                    )
+
+    final_states = [
+        (size, num_tokens)
+        for (phase, num_tokens), (size, _) in states[len(line)].items()
+        if phase == free
+    ]
+    if not final_states:
+        return None
+
+    # Walk back from the smallest final state, collecting the steps
+    size, num_tokens = min(final_states)
+    position, phase = len(line), free
+    steps = []
+    while position > 0:
+        step = states[position][(phase, num_tokens)][1]
+        steps.append(step)
+        position, phase, num_tokens = step[:3]
+    pattern = 0
+    num_tokens = 0
+    encoded_line = []
+    for position, phase, _, count in reversed(steps):
+        if count == 0:
+            encoded_line.append(line[position])
+            num_tokens += 1
+        elif phase == no_marker:
+            pattern |= 1 << num_tokens
+            encoded_line += encode_repeat_marker(count)
+            num_tokens += 1
+        else:
+            pattern |= 1 << num_tokens
+            encoded_line += encode_repeat_marker(count)
+            encoded_line.append(line[position])
+            num_tokens += 2
+    assert len(encoded_line) == size
+    return pattern | COMPRESSED_LINE_FLAG, encoded_line
+
+
+# Labels share most of their lines (e.g. the blank ones), so encoded lines are cached across images
+@functools.lru_cache(maxsize=4096)
+def encode_line(line, compression=Compression.FAST):
+    """Encode a line of a bitmap, given as `bytes`, compressing it if that makes it smaller."""
+    # The size of the encoded line, including the 7 bytes of header, must fit in a byte
+    assert 0 < len(line) <= 255 - 7, f"Lines of {len(line)} bytes are not supported"
+    if compression == Compression.NONE:
+        compressed_line = None
+    elif compression == Compression.FAST:
+        compressed_line = compress_line(line)
+    elif compression == Compression.MAX:
+        compressed_line = compress_line_optimal(line)
+    else:
+        raise ValueError(f"Invalid compression parameter: {compression}")
+    if compressed_line is not None and len(compressed_line[1]) < len(line):
+        pattern, line_data = compressed_line
+    else:
+        pattern, line_data = 0, line
+    return (
+        bytes([0x75, 3 + 4 + len(line_data), len(line)])
+        + pattern.to_bytes(4, "little")
+        + bytes(line_data)
+    )
+
+
+def find_unique_lines(lines):
+    """Like `np.unique(lines, axis=0, return_inverse=True)`, but much faster on small bitmaps."""
+    num_lines, num_line_bytes = lines.shape
+    keys = np.zeros((num_lines, -(-num_line_bytes // 8) * 8), dtype=np.uint8)
+    keys[:, :num_line_bytes] = lines
+    keys = keys.view(np.uint64)
+    order = np.lexsort(keys.T[::-1])
+    sorted_keys = keys[order]
+    is_first = np.empty(num_lines, dtype=bool)
+    is_first[0] = True
+    np.any(sorted_keys[1:] != sorted_keys[:-1], axis=1, out=is_first[1:])
+    inverse = np.empty(num_lines, dtype=np.intp)
+    inverse[order] = np.cumsum(is_first) - 1
+    return lines[order[is_first]], inverse
+
+
+def encode_lines(line_groups, prefix_size=0, compression=Compression.FAST):
+    """Encode groups of lines of packed bitmaps into a single buffer.
+
+    Each group is a 2D array of bytes with one line per row, all of the same size. The encoded lines
+    are written in order in a new `bytearray`, after `prefix_size` bytes that are left for the caller
+    to fill.
+    """
+    # Each distinct line is encoded once, then copied to all its positions with a single gather
+    encoded_lines = []
+    line_indices = []
+    for lines in line_groups:
+        unique_lines, inverse = find_unique_lines(lines)
+        line_indices.append(inverse + len(encoded_lines))
+        encoded_lines += [
+            encode_line(line.tobytes(), compression) for line in unique_lines
+        ]
+    inverse = np.concatenate(line_indices)
+    table = np.frombuffer(b"".join(encoded_lines), dtype=np.uint8)
+    unique_sizes = np.fromiter(map(len, encoded_lines), dtype=np.intp)
+    unique_starts = np.cumsum(unique_sizes) - unique_sizes
+
+    sizes = unique_sizes[inverse]
+    ends = np.cumsum(sizes)
+    total_size = int(ends[-1])
+    indices = np.repeat(unique_starts[inverse] - (ends - sizes), sizes)
+    indices += np.arange(total_size)
+
+    data = bytearray(prefix_size + total_size)
+    np.take(table, indices, out=np.frombuffer(data, dtype=np.uint8)[prefix_size:])
+    return data
+
+
+def compress_bitmap(bitmap, image_shape, compression=Compression.FAST):
+    """Encode a packed bitmap with one line per column, like the ones of `Layout.COLUMNS`."""
     width, height = image_shape
-    encoded_bitmap = []
     assert 0 < width
-    assert 0 < height <= 128
-    assert len(bitmap) == width
+    assert 0 < height
     num_line_bytes = math.ceil(height / 8)  # 1 byte = 8 pixels
-    compression_markers = [0b00000000, 0b00000000, 0b00000000, 0b00000000]
-    for col in range(width):
-        line_bitvec = list(bitmap[col])
-        assert (
-            len(line_bitvec) == num_line_bytes
-        ), f"Line {col} has {len(line_bitvec)} elements, but should have {num_line_bytes} elements."
-        encoded_line = (
-            [0x75, 3 + len(compression_markers) + len(line_bitvec), num_line_bytes]
-            + compression_markers
-            + line_bitvec
-        )
-        encoded_bitmap += encoded_line
-    return encoded_bitmap
+    assert bitmap.shape == (
+        width,
+        num_line_bytes,
+    ), f"Expected bitmap of shape {(width, num_line_bytes)}, but got {bitmap.shape}"
+    return encode_lines([bitmap], compression=compression)
@@ -0,0 +1,228 @@
+import time
+import asyncio
+import contextlib
+from gicisky_tag.writer import send_data_to_screen
+from gicisky_tag.metrics import TransferMetrics
+from gicisky_tag.scanner import device_address, device_adapter, find_devices
+from gicisky_tag.log import logger
+
+
+class UpdateResult:
+    """
+    Outcome of the update of one tag by `update_tags`.
+
+    Attributes:
+    - address: The Bluetooth address of the tag.
+    - success: Whether the image data has been sent, or skipped because it was unchanged.
+    - skipped: Whether the update has been skipped because the tag already shows the image.
+    - duration: The time spent updating the tag, including retries, in seconds.
+    - bytes: The size of the image data.
+    - retries: The number of failed attempts before the last one.
+    - error: The exception of the last failed attempt, or `None` if the update succeeded.
+    - metrics: The `TransferMetrics` of the update, including the failed attempts.
+    - deadline: When the update had to be done, as a Unix timestamp, or `None` if it had no deadline.
+    - finish_time: When the last attempt finished, as a Unix timestamp, or `None` if not attempted.
+    """
+
+    def __init__(self, address, image_data, deadline=None):
+        self.address = address
+        self.success = False
+        self.skipped = False
+        self.duration = 0.0
+        self.bytes = len(image_data)
+        self.retries = 0
+        self.error = None
+        self.metrics = TransferMetrics(address)
+        self.deadline = deadline
+        self.finish_time = None
+
+    def __repr__(self):
+        outcome = "skipped" if self.skipped else "ok" if self.success else "failed"
+        return (
+            f"UpdateResult({self.address}, {outcome}, {self.duration:.1f} s, "
+            f"{self.bytes} bytes, {self.retries} retries)"
+        )
+
+    @property
+    def missed_deadline(self):
+        """Whether the update had a deadline and failed, or finished after the deadline."""
+        if self.deadline is None:
+            return False
+        return not self.success or self.finish_time > self.deadline
+
+    def to_dict(self):
+        """The result as a dict that can be serialized as JSON, including the metrics."""
+        return {
+            **self.metrics.to_dict(),
+            "success": self.success,
+            "skipped": self.skipped,
+            "duration": self.duration,
+            "retries": self.retries,
+            "error": None if self.error is None else repr(self.error),
+            "deadline": self.deadline,
+            "finish_time": self.finish_time,
+            "missed_deadline": self.missed_deadline,
+        }
+
+
+class ConnectionSlots:
+    """
+    The connections that `update_tags` can open at the same time on each Bluetooth adapter.
+
+    Attributes:
+    - free_slots: The number of free slots of each adapter, with `None` for the default adapter.
+    """
+
+    def __init__(self, adapters, max_connections):
+        assert max_connections > 0
+        self.free_slots = {adapter: max_connections for adapter in adapters or [None]}
+        self.condition = asyncio.Condition()
+
+    async def acquire(self, adapter=None):
+        """Wait for a free slot on `adapter`, or on any adapter if `None`, returning its adapter."""
+        async with self.condition:
+            while True:
+                candidates = [
+                    candidate
+                    for candidate, free in self.free_slots.items()
+                    if free > 0 and adapter in (None, candidate)
+                ]
+                if candidates:
+                    # Spread the connections over the adapters
+                    candidate = max(candidates, key=self.free_slots.get)
+                    self.free_slots[candidate] -= 1
+                    return candidate
+                await self.condition.wait()
+
+    async def release(self, adapter):
+        async with self.condition:
+            self.free_slots[adapter] += 1
+            self.condition.notify_all()
+
+    def adapter_for(self, device):
+        """The adapter on which to connect to `device`, a `BLEDevice` or an address, or `None`.
+
+        On BlueZ, connecting to a `BLEDevice` goes through the adapter that saw it, so its slot must
+        be taken on that adapter. Devices seen by other adapters, and plain addresses, can be
+        connected on any adapter.
+        """
+        if isinstance(device, str):
+            return None
+        adapter = device_adapter(device)
+        return adapter if adapter in self.free_slots else None
+
+
+async def attempt_update(
+    address, image_data, result, adapter=None, attempt=0, retries=0, **kwargs
+):
+    """Make one attempt at updating a tag, recording its outcome in `result`, the `UpdateResult`.
+
+    Returns whether the attempt succeeded. `attempt` counts the failed attempts before this one, out
+    of `retries + 1`.
+    """
+    start_time = time.monotonic()
+    try:
+        sent = await send_data_to_screen(
+            address,
+            image_data,
+            adapter=adapter,
+            metrics=result.metrics,
+            **kwargs,
+        )
+    except Exception as e:
+        logger.warning(
+            f"Failed to update {result.address} (attempt {attempt + 1}/{retries + 1}): {e}"
+        )
+        result.error = e
+        result.retries = attempt
+        return False
+    else:
+        result.success = True
+        result.skipped = not sent
+        result.error = None
+        result.retries = attempt
+        return True
+    finally:
+        result.duration += time.monotonic() - start_time
+        result.finish_time = time.time()
+
+
+async def update_tag(address, image_data, slots, retries=0, **kwargs):
+    """Update one tag, waiting for a free slot in `slots`, and return its `UpdateResult`."""
+    result = UpdateResult(device_address(address), image_data)
+    adapter = await slots.acquire(slots.adapter_for(address))
+    try:
+        for attempt in range(retries + 1):
+            if await attempt_update(
+                address, image_data, result, adapter, attempt, retries, **kwargs
+            ):
+                break
+    finally:
+        await slots.release(adapter)
+    return result
+
+
+async def update_tags(
+    updates,
+    max_connections=3,
+    adapters=None,
+    retries=0,
+    store=None,
+    window=None,
+    reconnects=2,
+    timeouts=None,
+    scan_timeout=None,
+):
+    """Update many tags concurrently, returning an `UpdateResult` for each one, in order.
+
+    `updates` is an iterable of `(address, image_data)` pairs, where `address` can also be a
+    `BLEDevice`. At most `max_connections` tags are connected at the same time on each Bluetooth
+    adapter of `adapters` (e.g. `["hci0", "hci1"]`), or on the default adapter if `adapters` is
+    `None`. Failed updates are retried up to `retries` times.
+    See `send_data_to_screen` for the meaning of `store`, `window`, `reconnects` and `timeouts`.
+
+    If `scan_timeout` is provided, the tags given by address are first searched with `find_devices`,
+    and the update of each tag starts as soon as it's found, on the adapter that found it. The tags
+    not found within `scan_timeout` seconds are updated anyway, connecting to their plain address.
+    """
+    slots = ConnectionSlots(adapters, max_connections)
+
+    updates = list(updates)
+    tasks = [None] * len(updates)
+
+    def start_update(index, address):
+        tasks[index] = asyncio.create_task(
+            update_tag(
+                address,
+                updates[index][1],
+                slots,
+                retries=retries,
+                store=store,
+                window=window,
+                reconnects=reconnects,
+                timeouts=timeouts,
+            )
+        )
+
+    if scan_timeout is not None:
+        indices = {
+            address.upper(): index
+            for index, (address, _) in enumerate(updates)
+            if isinstance(address, str)
+        }
+        devices = find_devices(indices, scan_timeout, adapters=adapters)
+        async with contextlib.aclosing(devices):
+            async for device in devices:
+                start_update(indices[device.address.upper()], device)
+    for index, (address, _) in enumerate(updates):
+        if tasks[index] is None:
+            start_update(index, address)
+    results = await asyncio.gather(*tasks)
+
+    num_failed = sum(not result.success for result in results)
+    num_skipped = sum(result.skipped for result in results)
+    logger.info(
+        f"Updated {len(results) - num_failed - num_skipped} tags, "
+        f"skipped {num_skipped} unchanged tags, {num_failed} failed"
+    )
+    return results
@@ -0,0 +1,98 @@
+import time
+import contextlib
+
+# Upper bounds, in seconds, of the bins of the histogram of the block round trip times
+ROUND_TRIP_BINS = tuple(2**exponent / 1000 for exponent in range(13))  # 1 ms to 4 s
+
+
+def histogram(values, bins=ROUND_TRIP_BINS):
+    """Count the values in each bin, as a list of `(upper_bound, count)` pairs.
+
+    The last pair, with `None` as upper bound, counts the values above all the bins.
+    """
+    counts = [0] * (len(bins) + 1)
+    for value in values:
+        index = 0
+        while index < len(bins) and value > bins[index]:
+            index += 1
+        counts[index] += 1
+    return list(zip((*bins, None), counts))
+
+
+def percentile(values, fraction):
+    """The value below which `fraction` of the values fall, or `None` if there are no values."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+class TransferMetrics:
+    """
+    Timings of the update of a tag.
+
+    Each phase of the update (e.g. "connect", "mtu", "block_size", "write_screen", "start_transfer",
+    "update") can be measured several times, e.g. after a reconnection. The round trip of each image
+    block is measured from when the block is sent to when the tag requests the following one.
+
+    Attributes:
+    - address: The Bluetooth address of the tag, or `None` if unknown.
+    - start_time: When the metrics were created, as a Unix timestamp.
+    - phases: A dict from the name of each phase to the list of its durations, in seconds.
+    - block_round_trips: The round trip time of each image block, in seconds.
+    - bytes: The size of the image data, or `None` if unknown.
+    - blocks: The number of image blocks, or `None` if unknown.
+    """
+
+    def __init__(self, address=None):
+        self.address = address
+        self.start_time = time.time()
+        self.phases = {}
+        self.block_round_trips = []
+        self.bytes = None
+        self.blocks = None
+
+    def __repr__(self):
+        phases = ", ".join(
+            f"{phase} {sum(durations):.3f} s"
+            for phase, durations in self.phases.items()
+        )
+        return f"TransferMetrics({self.address}: {phases})"
+
+    def record(self, phase, duration):
+        self.phases.setdefault(phase, []).append(duration)
+
+    @contextlib.contextmanager
+    def measure(self, phase):
+        """Context manager that records the time spent in its body as a duration of `phase`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, time.perf_counter() - start)
+
+    def to_dict(self):
+        """The metrics as a dict that can be serialized as JSON, e.g. as a line of a JSON lines file."""
+        round_trips = self.block_round_trips
+        return {
+            "address": self.address,
+            "start_time": self.start_time,
+            "bytes": self.bytes,
+            "blocks": self.blocks,
+            "phases": {
+                phase: {
+                    "count": len(durations),
+                    "total": sum(durations),
+                    "max": max(durations),
+                }
+                for phase, durations in self.phases.items()
+            },
+            "block_round_trips": {
+                "count": len(round_trips),
+                "mean": sum(round_trips) / len(round_trips) if round_trips else None,
+                "p50": percentile(round_trips, 0.5),
+                "p90": percentile(round_trips, 0.9),
+                "max": max(round_trips, default=None),
+                "histogram": histogram(round_trips),
+            },
+        }
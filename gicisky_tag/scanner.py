@@ -1,24 +1,378 @@
+import time
 import asyncio
 from bleak import BleakScanner
+from gicisky_tag.models import DEFAULT_MODEL, decode_device_type
 from gicisky_tag.log import logger
 
+# Manufacturer ID of the advertisements of the tags
+MANUFACTURER_ID = 0x5053
+
+# Time for which a device seen by the scanner is used to connect without a new scan, in seconds
+DEVICE_CACHE_MAX_AGE = 60.0
+
+
+class SeenTag:
+    """
+    A tag seen by the scanner.
+
+    The manufacturer data of the advertisements of the tags contains the device type (low byte),
+    the battery voltage multiplied by 10, the software version, the hardware version and the device
+    type (high byte).
+
+    Attributes:
+    - device: The `BLEDevice` of the tag, which can be passed to `BleakClient` to connect without a
+      new scan.
+    - address: The Bluetooth address of the tag, in upper case.
+    - rssi: The signal strength of the last advertisement, in dBm.
+    - manufacturer_data: The manufacturer data of the last advertisement, as `bytes`.
+    - last_seen: When the tag was last seen, as a Unix timestamp.
+    - mtu_size: The MTU of the last connection to the tag, or `None` if unknown.
+    """
+
+    def __init__(self, device, rssi, manufacturer_data):
+        self.device = device
+        self.address = device.address.upper()
+        self.rssi = rssi
+        self.manufacturer_data = manufacturer_data
+        self.last_seen = time.time()
+        self.mtu_size = None
+
+    def __repr__(self):
+        return (
+            f"SeenTag({self.address}, {self.rssi} dBm, {self.battery_voltage} V, "
+            f"{self.age():.1f} s ago)"
+        )
+
+    def age(self):
+        return time.time() - self.last_seen
+
+    @property
+    def battery_voltage(self):
+        """The battery voltage, in volts, or `None` if unknown."""
+        if len(self.manufacturer_data) < 2:
+            return None
+        return self.manufacturer_data[1] / 10
+
+    @property
+    def device_type(self):
+        """The device type, which describes the screen of the tag, or `None` if unknown."""
+        if len(self.manufacturer_data) < 5:
+            return None
+        return self.manufacturer_data[0] | self.manufacturer_data[4] << 8
+
+    @property
+    def screen_type(self):
+        """The `ScreenType` decoded from the device type, or `None` if unknown."""
+        device_type = self.device_type
+        return None if device_type is None else decode_device_type(device_type)
+
+    @property
+    def model(self):
+        """The `ScreenModel` of the tag, or `None` if unknown."""
+        screen_type = self.screen_type
+        return None if screen_type is None else screen_type.model
+
+    @property
+    def software_version(self):
+        return self.manufacturer_data[2] if len(self.manufacturer_data) > 2 else None
+
+    @property
+    def hardware_version(self):
+        return self.manufacturer_data[3] if len(self.manufacturer_data) > 3 else None
+
+
+class TagRegistry:
+    """
+    Registry of the tags seen by the scanner, keyed by their Bluetooth address.
+
+    On BlueZ, connecting to a plain address makes `BleakClient` scan for the device first, which can
+    take several seconds. Connecting to the `BLEDevice` of a recently seen tag skips that scan.
+
+    Attributes:
+    - max_age: Time after which a tag isn't used to connect anymore, in seconds.
+    """
+
+    def __init__(self, max_age=DEVICE_CACHE_MAX_AGE):
+        self.max_age = max_age
+        self.seen_tags = {}
+
+    def __len__(self):
+        return len(self.seen_tags)
+
+    def add(self, device, rssi, manufacturer_data):
+        """Record that a tag has just been seen, keeping the MTU of its last connection."""
+        seen = SeenTag(device, rssi, manufacturer_data)
+        previous = self.seen_tags.get(seen.address)
+        if previous is not None:
+            seen.mtu_size = previous.mtu_size
+        self.seen_tags[seen.address] = seen
+        return seen
+
+    def merge(self, seen):
+        """Add a `SeenTag` recorded elsewhere, e.g. in a `ScanCache`, unless it's older."""
+        previous = self.seen_tags.get(seen.address)
+        if previous is None or previous.last_seen < seen.last_seen:
+            self.seen_tags[seen.address] = seen
+
+    def forget(self, address):
+        self.seen_tags.pop(address.upper(), None)
+
+    def get(self, address, max_age=None):
+        """The `SeenTag` with the given address, or `None` if it hasn't been seen recently.
+
+        `max_age` defaults to the `max_age` of the registry.
+        """
+        seen = self.seen_tags.get(address.upper())
+        if seen is None or seen.age() > (self.max_age if max_age is None else max_age):
+            return None
+        return seen
+
+    def tags(self, max_age=None, min_rssi=None):
+        """The tags seen in the last `max_age` seconds, with at least `min_rssi` dBm.
+
+        The tags are sorted from the strongest signal to the weakest. If `max_age` is `None`, all
+        the tags ever seen are included.
+        """
+        now = time.time()
+        tags = [
+            seen
+            for seen in self.seen_tags.values()
+            if (max_age is None or now - seen.last_seen <= max_age)
+            and (min_rssi is None or seen.rssi >= min_rssi)
+        ]
+        tags.sort(key=lambda seen: seen.rssi, reverse=True)
+        return tags
+
+    def set_mtu_size(self, address, mtu_size):
+        """Remember the MTU of a connection to a recently seen tag."""
+        seen = self.get(address)
+        if seen is not None:
+            seen.mtu_size = mtu_size
+
+
+tag_registry = TagRegistry()
+
+
+def device_address(device):
+    """The Bluetooth address of a `BLEDevice`, or the address itself if given a string."""
+    return device if isinstance(device, str) else device.address
+
+
+def device_adapter(device):
+    """The BlueZ adapter that saw a `BLEDevice`, like `"hci0"`, or `None` if unknown."""
+    details = device.details
+    if not isinstance(details, dict) or "path" not in details:
+        return None
+    # The D-Bus path of the device is like /org/bluez/hci0/dev_FF_FF_00_00_00_01
+    return details["path"].split("/")[3]
 
-async def find_address():
-    address = None
+
+def resolve_device(device, registry=tag_registry, adapter=None):
+    """What to pass to `BleakClient` to connect to `device`, a `BLEDevice` or an address.
+
+    Addresses of tags recently seen by the scanner are resolved to their `BLEDevice`. The devices
+    that can't be used to connect, like the ones restored by `ScanCache` on backends other than
+    BlueZ, are replaced by their plain address, even if they're given directly, e.g. by
+    `find_devices`.
+
+    On BlueZ, `BleakClient` connects to a `BLEDevice` through the adapter that saw it, ignoring its
+    `adapter` argument. So if `adapter` is provided, only the devices seen by that adapter are used,
+    and the plain address is returned for the others.
+    """
+    address = device_address(device)
+    if isinstance(device, str):
+        seen = registry.get(address)
+        if seen is None:
+            return address
+        device = seen.device
+        logger.debug(f"Using the device {address} seen {seen.age():.1f} s ago")
+    if device.details is None:
+        # Bleak needs the platform details of the device to connect to it
+        return address
+    if adapter is not None and device_adapter(device) != adapter:
+        logger.debug(f"The device {address} wasn't seen by {adapter}")
+        return address
+    return device
+
+
+def detect_model(address, registry=tag_registry, default=DEFAULT_MODEL):
+    """The `ScreenModel` of the tag at `address`, a `BLEDevice` or an address.
+
+    The model is detected from the advertisements of the tag recorded in `registry`, whatever their
+    age. If the tag hasn't been seen, or its model is unknown, `default` is returned.
+    """
+    address = device_address(address)
+    seen = registry.get(address, max_age=float("inf"))
+    model = None if seen is None else seen.model
+    if model is None:
+        logger.warning(f"Unknown model of {address}, assuming {default}")
+        return default
+    logger.debug(f"Detected model {model} for {address}: {seen.screen_type!r}")
+    return model
+
+
+def is_gicisky_tag(device, advertisement_data):
+    return (
+        device.address.upper().startswith("FF:FF")
+        and MANUFACTURER_ID in advertisement_data.manufacturer_data
+    )
+
+
+class TagScanner:
+    """
+    Long-running scanner that records every tag it sees in a `TagRegistry`.
+
+    The registry can be queried at any time, without waiting for a scan:
+
+        async with TagScanner() as scanner:
+            ...
+            reachable_tags = scanner.registry.tags(max_age=10)
+
+    Tags advertise many times per second, so the advertisements of a tag are ignored for
+    `min_interval` seconds after it is recorded, and an advertisement with unchanged manufacturer
+    data only updates the signal strength and the time of the recorded tag.
+
+    Attributes:
+    - registry: The `TagRegistry` in which tags are recorded.
+    - min_interval: See above, in seconds.
+    - adapter: The Bluetooth adapter to use, see `connect_to_tag`.
+    """
+
+    def __init__(self, registry=None, min_interval=1.0, adapter=None):
+        self.registry = tag_registry if registry is None else registry
+        self.min_interval = min_interval
+        self.adapter = adapter
+        scanner_kwargs = {} if adapter is None else {"adapter": adapter}
+        self.scanner = BleakScanner(self.handle_advertisement, **scanner_kwargs)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    async def start(self):
+        await self.scanner.start()
+
+    async def stop(self):
+        await self.scanner.stop()
+
+    def handle_advertisement(self, device, advertisement_data):
+        manufacturer_data = advertisement_data.manufacturer_data.get(MANUFACTURER_ID)
+        if manufacturer_data is None:
+            return
+        seen = self.registry.seen_tags.get(device.address.upper())
+        if seen is not None:
+            now = time.time()
+            if now - seen.last_seen < self.min_interval:
+                return
+            if seen.manufacturer_data == manufacturer_data:
+                seen.last_seen = now
+                seen.rssi = advertisement_data.rssi
+                return
+        elif not is_gicisky_tag(device, advertisement_data):
+            return
+        seen = self.registry.add(device, advertisement_data.rssi, manufacturer_data)
+        logger.debug(f"Seen {seen}")
+
+
+async def find_device(registry=tag_registry, max_age=None):
+    """Scan until a Gicisky tag is found, returning its `BLEDevice`.
+
+    All the tags seen during the scan are recorded in `registry`. If `max_age` is provided and a
+    tag has been seen in the last `max_age` seconds, the one with the strongest signal is returned
+    without scanning.
+    """
+    if max_age is not None:
+        seen_tags = registry.tags(max_age=max_age)
+        if seen_tags:
+            logger.info(f"Using the recently seen device {seen_tags[0].address}")
+            return seen_tags[0].device
+
+    found_device = None
 
     def scan_callback(device, data):
-        nonlocal address
-        if str(device).upper().startswith("FF:FF") and 20563 in data.manufacturer_data:
-            address = str(device)[0:17]
+        nonlocal found_device
+        if is_gicisky_tag(device, data):
+            manufacturer_data = data.manufacturer_data[MANUFACTURER_ID]
+            seen = registry.add(device, data.rssi, manufacturer_data)
+            if found_device is not None:
+                return
+            found_device = device
             logger.debug(f"Device {device}: {data}")
-            manufacturer_data = data.manufacturer_data[20563]
-            power_data = float(manufacturer_data[1]) / 10
-            logger.info(f"Found device {address}. Battery: {power_data:.1f} V")
+            logger.info(
+                f"Found device {seen.address}. Battery: {seen.battery_voltage:.1f} V"
+            )
 
     scanner = BleakScanner(scan_callback)
-    while address is None:
+    while found_device is None:
         await scanner.start()
         await asyncio.sleep(1.0)
         await scanner.stop()
 
-    return address
+    return found_device
+
+
+async def find_devices(addresses, timeout=10.0, registry=tag_registry, adapters=None):
+    """Scan for the tags with the given addresses, yielding the `BLEDevice` of each one once found.
+
+    The tags recently seen in `registry` are yielded right away, without scanning. The scan runs on
+    each Bluetooth adapter of `adapters`, or on the default adapter if `None`, and each tag is
+    yielded with the device of the first adapter that sees it, see `device_adapter`. The scan stops
+    as soon as all the tags have been found, or after `timeout` seconds. Use `contextlib.aclosing`
+    to stop it when leaving the loop early.
+    """
+    pending = {address.upper() for address in addresses}
+    for address in sorted(pending):
+        seen = registry.get(address)
+        if seen is not None:
+            pending.discard(address)
+            yield seen.device
+    if not pending:
+        return
+
+    # Most advertisements come from other devices, which are filtered out without building the
+    # upper-case address
+    prefixes = {address[:5] for address in pending}
+    found = asyncio.Queue()
+
+    def scan_callback(device, data):
+        if device.address[:5].upper() not in prefixes:
+            return
+        address = device.address.upper()
+        if address not in pending:
+            return
+        pending.discard(address)
+        manufacturer_data = data.manufacturer_data.get(MANUFACTURER_ID)
+        if manufacturer_data is not None:
+            registry.add(device, data.rssi, manufacturer_data)
+        logger.info(f"Found device {address}")
+        found.put_nowait(device)
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    num_pending = len(pending)
+    scanners = []
+    try:
+        for adapter in adapters or [None]:
+            scanner_kwargs = {} if adapter is None else {"adapter": adapter}
+            scanner = BleakScanner(scan_callback, **scanner_kwargs)
+            await scanner.start()
+            scanners.append(scanner)
+        while num_pending > 0:
+            try:
+                device = await asyncio.wait_for(found.get(), deadline - loop.time())
+            except asyncio.TimeoutError:
+                logger.warning(f"Devices not found: {', '.join(sorted(pending))}")
+                return
+            num_pending -= 1
+            yield device
+    finally:
+        for scanner in scanners:
+            await scanner.stop()
+
+
+async def find_address():
+    """Scan until a Gicisky tag is found, returning its Bluetooth address."""
+    return (await find_device()).address
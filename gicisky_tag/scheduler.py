@@ -0,0 +1,164 @@
+import math
+import time
+import heapq
+import asyncio
+import itertools
+from gicisky_tag.fleet import UpdateResult, ConnectionSlots, attempt_update
+from gicisky_tag.scanner import tag_registry, device_address
+from gicisky_tag.log import logger
+
+# Rough timings of an update on a good link, used to estimate its duration: connecting and the
+# requests before the transfer, and the round trip of each image block.
+SETUP_TIME = 2.0
+BLOCK_TIME = 0.06
+
+# Below this signal strength, in dBm, each 10 dB less doubles the estimated duration
+WEAK_RSSI = -75
+
+# Below this battery voltage, in volts, the estimated duration is increased by half
+LOW_BATTERY_VOLTAGE = 2.5
+
+
+def estimate_update_time(num_bytes, block_size=244, rssi=None, battery_voltage=None):
+    """Estimate the duration of the update of a tag with `num_bytes` of image data, in seconds.
+
+    The estimate grows with the number of image blocks, each carrying `block_size - 4` bytes of
+    image data, and is increased for tags with a weak signal or a low battery.
+    """
+    num_blocks = math.ceil(num_bytes / (block_size - 4))
+    estimate = SETUP_TIME + num_blocks * BLOCK_TIME
+    if rssi is not None and rssi < WEAK_RSSI:
+        estimate *= 2 ** ((WEAK_RSSI - rssi) / 10)
+    if battery_voltage is not None and battery_voltage < LOW_BATTERY_VOLTAGE:
+        estimate *= 1.5
+    return estimate
+
+
+class UpdateJob:
+    """
+    An update to run with `schedule_updates`.
+
+    Attributes:
+    - address: The Bluetooth address of the tag. A `BLEDevice` can be passed instead.
+    - image_data: The encoded image data to send.
+    - deadline: When the tag should show the image, as a Unix timestamp, or `None`.
+    - priority: Jobs with a higher priority are started first.
+    - estimate: The estimated duration of the update, in seconds, see `estimate_update_time`.
+    - attempts: The number of failed attempts so far.
+    - result: The `UpdateResult` of the job.
+    """
+
+    def __init__(self, address, image_data, deadline=None, priority=0):
+        self.device = address
+        self.address = device_address(address)
+        self.image_data = image_data
+        self.deadline = deadline
+        self.priority = priority
+        self.estimate = None
+        self.attempts = 0
+        self.result = UpdateResult(self.address, image_data, deadline=deadline)
+
+    def __repr__(self):
+        estimate = "unknown" if self.estimate is None else f"{self.estimate:.1f} s"
+        return (
+            f"UpdateJob({self.address}, priority {self.priority}, estimate {estimate})"
+        )
+
+    def sort_key(self, now):
+        """The order in which to start the jobs: lower keys first.
+
+        Jobs are ordered by priority, then first attempts come before retries, so that tags that
+        fail don't hold back the others. Then jobs with the least time left before the latest start
+        that meets their deadline come first, followed by jobs without a deadline and jobs that
+        can't meet it anymore. Ties are broken by starting the shortest jobs first.
+        """
+        latest_start = math.inf
+        if self.deadline is not None and now + self.estimate <= self.deadline:
+            latest_start = self.deadline - self.estimate
+        return (-self.priority, self.attempts, latest_start, self.estimate)
+
+
+async def schedule_updates(
+    jobs,
+    max_connections=3,
+    adapters=None,
+    retries=0,
+    block_size=244,
+    registry=tag_registry,
+    **kwargs,
+):
+    """Run many `UpdateJob`s concurrently, returning the `UpdateResult` of each one, in order.
+
+    The jobs are started in the order of `UpdateJob.sort_key`, with durations estimated from the
+    size of the image data, `block_size` and the signal strength and battery voltage of the tags
+    recorded in `registry`. Each job waits for a slot of `ConnectionSlots`, on the adapter that saw
+    its tag if it's a `BLEDevice`, before the next jobs are started. See `update_tags` for the
+    meaning of `max_connections`, `adapters` and `retries`, and `send_data_to_screen` for the other
+    arguments. Failed attempts are queued again, instead of being retried right away.
+    """
+    jobs = list(jobs)
+    slots = ConnectionSlots(adapters, max_connections)
+    queue = []
+    # Breaks the ties between keys, keeping the order of the jobs
+    order = itertools.count()
+
+    def enqueue(job):
+        heapq.heappush(queue, (job.sort_key(time.time()), next(order), job))
+
+    for job in jobs:
+        seen = registry.get(job.address, max_age=math.inf)
+        job.estimate = estimate_update_time(
+            len(job.image_data),
+            block_size,
+            rssi=None if seen is None else seen.rssi,
+            battery_voltage=None if seen is None else seen.battery_voltage,
+        )
+        if job.deadline is not None and time.time() + job.estimate > job.deadline:
+            logger.warning(f"The update of {job.address} can't meet its deadline")
+        enqueue(job)
+
+    async def run_attempt(job, adapter):
+        try:
+            success = await attempt_update(
+                job.device,
+                job.image_data,
+                job.result,
+                adapter,
+                job.attempts,
+                retries,
+                **kwargs,
+            )
+        finally:
+            await slots.release(adapter)
+        if not success:
+            job.attempts += 1
+            if job.attempts <= retries:
+                enqueue(job)
+
+    running = set()
+    try:
+        while queue or running:
+            if not queue:
+                # Failed attempts are queued again when they finish
+                await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                continue
+            _, _, job = heapq.heappop(queue)
+            adapter = await slots.acquire(slots.adapter_for(job.device))
+            task = asyncio.create_task(run_attempt(job, adapter))
+            running.add(task)
+            task.add_done_callback(running.discard)
+    finally:
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+    results = [job.result for job in jobs]
+    num_failed = sum(not result.success for result in results)
+    missed = [result.address for result in results if result.missed_deadline]
+    logger.info(
+        f"Updated {len(results) - num_failed} tags, {num_failed} failed, "
+        f"{len(missed)} missed their deadline"
+    )
+    if missed:
+        logger.warning(f"Missed deadlines: {', '.join(missed)}")
+    return results
@@ -0,0 +1,265 @@
+import random
+import asyncio
+from bleak.exc import BleakError
+from gicisky_tag.writer import ScreenWriter
+from gicisky_tag.decoder import decode_image, render_image
+from gicisky_tag.models import DEFAULT_MODEL
+from gicisky_tag.log import logger
+
+
+class SimulatedCharacteristic:
+    """A GATT characteristic of a `SimulatedTag`, standing in for `BleakGATTCharacteristic`."""
+
+    def __init__(self, uuid):
+        self.uuid = uuid
+
+    def __str__(self):
+        return self.uuid
+
+
+class SimulatedServices:
+    """The GATT services of a `SimulatedTag`, standing in for `BleakGATTServiceCollection`."""
+
+    def __init__(self, uuids):
+        self.characteristics = {uuid: SimulatedCharacteristic(uuid) for uuid in uuids}
+
+    def get_characteristic(self, specifier):
+        return self.characteristics.get(str(specifier))
+
+
+class SimulatedTag:
+    """
+    In-process simulation of a Gicisky tag, standing in for a connected `BleakClient`.
+
+    The tag implements the requests and notifications used by `ScreenWriter`: it reports its block
+    size, accepts the image size, requests the image blocks one by one and, once all the image data
+    is received, decodes it. Each packet (write, write response or notification) takes `latency`
+    seconds, plus or minus a random `jitter`, to go through the link, and the tag takes
+    `processing_time` seconds to handle each write, one at a time. Writes without response are lost
+    with probability `loss`, in which case the tag keeps waiting for the block that it requested.
+
+    The link drops once `disconnect_after` image blocks have been written, calling
+    `disconnected_callback` like `BleakClient` does. The same `SimulatedTag` can then be connected
+    again, and if `keep_progress` is true the tag resumes the transfer where it stopped.
+
+    Attributes:
+    - address: The Bluetooth address of the tag.
+    - model: The `ScreenModel` of the tag, used to decode the received image data.
+    - block_size: The block size reported by the tag.
+    - mtu_size: The MTU of the connection, which limits the size of writes without response.
+    - latency, jitter, processing_time, loss: See above.
+    - disconnect_after, keep_progress, disconnected_callback: See above.
+    - image_data: The last image data completely received by the tag, or `None`.
+    - num_writes: The number of image blocks written to the tag, including the lost ones.
+    - num_lost_writes: The number of image blocks lost.
+    """
+
+    def __init__(
+        self,
+        address="FF:FF:00:00:00:01",
+        model=DEFAULT_MODEL,
+        block_size=244,
+        mtu_size=247,
+        latency=0.0,
+        jitter=0.0,
+        processing_time=0.0,
+        loss=0.0,
+        disconnect_after=None,
+        keep_progress=True,
+        disconnected_callback=None,
+        seed=None,
+    ):
+        assert 4 < block_size
+        assert 0 <= jitter <= latency
+        assert 0 <= loss < 1
+        self.address = address
+        self.model = model
+        self.block_size = block_size
+        self.mtu_size = mtu_size
+        self.latency = latency
+        self.jitter = jitter
+        self.processing_time = processing_time
+        self.loss = loss
+        self.disconnect_after = disconnect_after
+        self.keep_progress = keep_progress
+        self.disconnected_callback = disconnected_callback
+        self.random = random.Random(seed)
+        self.services = SimulatedServices(
+            [ScreenWriter.REQUEST_CHARACTERISTIC, ScreenWriter.IMAGE_CHARACTERISTIC]
+        )
+        self.is_connected = False
+        self.image_data = None
+        self.num_writes = 0
+        self.num_lost_writes = 0
+        self.notify_callback = None
+        self.image_size = None
+        self.received_data = bytearray()
+        self.requested_part = None
+        self.pending_writes = None
+        self.pending_notifications = None
+        self.workers = []
+        self.last_write_arrival = 0.0
+        self.last_notification_arrival = 0.0
+
+    def __repr__(self):
+        return f"SimulatedTag({self.address!r})"
+
+    async def connect(self):
+        self.is_connected = True
+        self.pending_writes = asyncio.Queue()
+        self.pending_notifications = asyncio.Queue()
+        self.workers = [
+            asyncio.create_task(self.handle_writes()),
+            asyncio.create_task(self.handle_notifications()),
+        ]
+
+    async def disconnect(self):
+        self.close_link()
+
+    def close_link(self):
+        self.is_connected = False
+        self.notify_callback = None
+        for worker in self.workers:
+            worker.cancel()
+        self.workers = []
+
+    def drop_connection(self):
+        """Simulate the loss of the link, like when the tag goes out of range."""
+        logger.debug(f"Simulated tag: dropping the connection of {self.address}")
+        self.close_link()
+        if self.disconnected_callback is not None:
+            self.disconnected_callback(self)
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.disconnect()
+
+    async def start_notify(self, characteristic, callback):
+        assert str(characteristic) == ScreenWriter.REQUEST_CHARACTERISTIC
+        self.notify_callback = callback
+
+    async def stop_notify(self, characteristic):
+        assert str(characteristic) == ScreenWriter.REQUEST_CHARACTERISTIC
+        self.notify_callback = None
+
+    async def write_gatt_char(self, characteristic, data, response=None):
+        if not self.is_connected:
+            raise BleakError(f"Not connected to {self.address}")
+        uuid = str(characteristic)
+        if uuid not in self.services.characteristics:
+            raise BleakError(f"Characteristic {uuid} was not found!")
+        if not response and len(data) > self.mtu_size - 3:
+            raise BleakError(
+                f"Write without response of {len(data)} bytes, but the MTU is {self.mtu_size}"
+            )
+        data = bytes(data)
+        if uuid == ScreenWriter.IMAGE_CHARACTERISTIC:
+            self.num_writes += 1
+            if self.num_writes == self.disconnect_after:
+                self.drop_connection()
+                raise BleakError(f"Disconnected from {self.address}")
+            if not response and self.random.random() < self.loss:
+                self.num_lost_writes += 1
+                return
+
+        # Writes are handled in order by `handle_writes`, after they go through the link
+        handled = asyncio.get_running_loop().create_future()
+        arrival = self.link_arrival_time(self.last_write_arrival)
+        self.last_write_arrival = arrival
+        self.pending_writes.put_nowait((arrival, uuid, data, handled))
+        if response:
+            await handled
+            await asyncio.sleep(self.link_arrival_time() - self.loop_time())
+
+    def loop_time(self):
+        return asyncio.get_running_loop().time()
+
+    def link_arrival_time(self, previous_arrival=0.0):
+        """The time at which a packet sent now goes through the link, after `previous_arrival`."""
+        delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+        return max(self.loop_time() + delay, previous_arrival)
+
+    async def handle_writes(self):
+        while True:
+            arrival, uuid, data, handled = await self.pending_writes.get()
+            await asyncio.sleep(max(arrival - self.loop_time(), 0))
+            if self.processing_time > 0:
+                await asyncio.sleep(self.processing_time)
+            try:
+                if uuid == ScreenWriter.REQUEST_CHARACTERISTIC:
+                    self.handle_request(data)
+                else:
+                    self.handle_image_block(data)
+            except Exception as e:
+                handled.set_exception(e)
+            else:
+                handled.set_result(None)
+
+    def notify(self, data):
+        arrival = self.link_arrival_time(self.last_notification_arrival)
+        self.last_notification_arrival = arrival
+        self.pending_notifications.put_nowait((arrival, data))
+
+    async def handle_notifications(self):
+        while True:
+            arrival, data = await self.pending_notifications.get()
+            await asyncio.sleep(max(arrival - self.loop_time(), 0))
+            if self.notify_callback is None:
+                continue
+            result = self.notify_callback(
+                self.services.get_characteristic(ScreenWriter.REQUEST_CHARACTERISTIC),
+                bytearray(data),
+            )
+            # Like bleak, run the coroutine of async callbacks in the background
+            if asyncio.iscoroutine(result):
+                asyncio.get_running_loop().create_task(result)
+
+    def request_part(self, part):
+        self.requested_part = part
+        self.notify([0x05, 0x00, *part.to_bytes(4, "little")])
+
+    def handle_request(self, data):
+        if data[0] == 0x01:
+            self.notify([0x01, *self.block_size.to_bytes(2, "little")])
+        elif data[0] == 0x02:
+            image_size = int.from_bytes(data[1:5], "little")
+            if not self.keep_progress or image_size != self.image_size:
+                self.received_data = bytearray()
+            self.image_size = image_size
+            self.notify([0x02, 0x00])
+        elif data[0] == 0x03:
+            assert self.image_size is not None, "Start transfer before write screen"
+            self.request_part(len(self.received_data) // (self.block_size - 4))
+        elif data[0] == 0x04:
+            self.image_size = None
+            self.requested_part = None
+            self.notify([0x04, 0x00])
+        else:
+            logger.warning(f"Simulated tag: unknown request {data.hex()}")
+
+    def handle_image_block(self, data):
+        part = int.from_bytes(data[:4], "little")
+        if part != self.requested_part:
+            # The tag only accepts the block that it requested
+            return
+        self.received_data += data[4:]
+        if len(self.received_data) < self.image_size:
+            self.request_part(part + 1)
+            return
+
+        self.image_data = bytes(self.received_data[: self.image_size])
+        self.image_size = None
+        self.requested_part = None
+        self.notify([0x05, 0x08, *(part + 1).to_bytes(4, "little")])
+
+    def decode_image(self):
+        """Decode the last received image data, see `decoder.decode_image`."""
+        assert self.image_data is not None, "No image data received"
+        return decode_image(self.image_data, self.model)
+
+    def render_image(self):
+        """Render the last received image data as an RGB image, as it would look on the screen."""
+        return render_image(*self.decode_image())
@@ -0,0 +1,160 @@
+import time
+import hashlib
+import sqlite3
+from bleak.backends.device import BLEDevice
+from gicisky_tag.scanner import SeenTag
+from gicisky_tag.log import logger
+
+# Time for which the tags recorded in a `ScanCache` are used, in seconds
+SCAN_CACHE_TTL = 3600.0
+
+
+def payload_digest(image_data):
+    """Hash of the encoded image data, as `bytes`."""
+    return hashlib.sha256(image_data).digest()
+
+
+class PayloadStore:
+    """
+    Persistent store of the last image data successfully sent to each tag.
+
+    Only a hash of the image data is stored, in a SQLite database, keyed by the Bluetooth address of
+    the tag. This makes it possible to skip the update of tags that already show an image.
+
+    Attributes:
+    - path: The path of the SQLite database. It's created if it doesn't exist.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS payloads ("
+                "address TEXT PRIMARY KEY, digest BLOB NOT NULL, updated REAL NOT NULL)"
+            )
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def is_unchanged(self, address, image_data):
+        """Whether `image_data` is the last image data recorded for the tag at `address`."""
+        row = self.connection.execute(
+            "SELECT digest FROM payloads WHERE address = ?", (address.upper(),)
+        ).fetchone()
+        return row is not None and row[0] == payload_digest(image_data)
+
+    def record(self, address, image_data):
+        """Record `image_data` as the last image data successfully sent to the tag at `address`."""
+        logger.debug(f"Recording the image data sent to {address}")
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO payloads (address, digest, updated) VALUES (?, ?, ?)",
+                (address.upper(), payload_digest(image_data), time.time()),
+            )
+
+    def forget(self, address):
+        """Forget the image data of the tag at `address`, so that the next update isn't skipped."""
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM payloads WHERE address = ?", (address.upper(),)
+            )
+
+
+class ScanCache:
+    """
+    Persistent cache of the tags seen by the scanner, to skip scanning in the next runs.
+
+    For each tag, the cache stores the address, the manufacturer data of its advertisements (which
+    describes the model of the tag), the signal strength, the MTU of the last connection and when
+    the tag was last seen, in a SQLite database. On BlueZ, it also stores the D-Bus path of the
+    device, which makes it possible to connect to it without scanning.
+
+    Attributes:
+    - path: The path of the SQLite database. It's created if it doesn't exist.
+    - ttl: Time after which a tag recorded in the cache is ignored, in seconds.
+    """
+
+    def __init__(self, path, ttl=SCAN_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS tags ("
+                "address TEXT PRIMARY KEY, name TEXT, device_path TEXT, rssi INTEGER, "
+                "manufacturer_data BLOB NOT NULL, mtu_size INTEGER, last_seen REAL NOT NULL)"
+            )
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def load(self, registry):
+        """Add the tags of the cache seen in the last `ttl` seconds to the `TagRegistry`.
+
+        The `max_age` of the registry is raised to `ttl`, so that the tags can be used to connect.
+        Returns the number of loaded tags.
+        """
+        rows = self.connection.execute(
+            "SELECT address, name, device_path, rssi, manufacturer_data, mtu_size, last_seen "
+            "FROM tags WHERE last_seen >= ?",
+            (time.time() - self.ttl,),
+        ).fetchall()
+        for (
+            address,
+            name,
+            device_path,
+            rssi,
+            manufacturer_data,
+            mtu_size,
+            last_seen,
+        ) in rows:
+            details = (
+                None if device_path is None else {"path": device_path, "props": {}}
+            )
+            seen = SeenTag(
+                BLEDevice(address, name, details, rssi=rssi), rssi, manufacturer_data
+            )
+            seen.mtu_size = mtu_size
+            seen.last_seen = last_seen
+            registry.merge(seen)
+        registry.max_age = max(registry.max_age, self.ttl)
+        logger.debug(f"Loaded {len(rows)} tags from the scan cache")
+        return len(rows)
+
+    def save(self, registry):
+        """Record the tags of the `TagRegistry` seen in the last `ttl` seconds."""
+        seen_tags = registry.tags(max_age=self.ttl)
+        with self.connection:
+            for seen in seen_tags:
+                details = seen.device.details
+                device_path = details.get("path") if isinstance(details, dict) else None
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO tags (address, name, device_path, rssi, "
+                    "manufacturer_data, mtu_size, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        seen.address,
+                        seen.device.name,
+                        device_path,
+                        seen.rssi,
+                        bytes(seen.manufacturer_data),
+                        seen.mtu_size,
+                        seen.last_seen,
+                    ),
+                )
+            self.connection.execute(
+                "DELETE FROM tags WHERE last_seen < ?", (time.time() - self.ttl,)
+            )
+        logger.debug(f"Saved {len(seen_tags)} tags to the scan cache")
@@ -1,10 +1,96 @@
 import math
+import time
 import asyncio
 import logging
+import contextlib
 from bleak import BleakClient
+from bleak.exc import BleakError
+from gicisky_tag import capture
+from gicisky_tag.capture import PacketKind
+from gicisky_tag.metrics import TransferMetrics
+from gicisky_tag.scanner import tag_registry, resolve_device, device_address
 from gicisky_tag.log import logger
 
 
+class TagDisconnectedError(ConnectionError):
+    """The connection to the tag has been lost during an update."""
+
+
+class TransferTimeoutError(asyncio.TimeoutError):
+    """
+    A phase of the update of a tag didn't complete before its deadline.
+
+    Attributes:
+    - phase: The name of the phase, like the attributes of `Timeouts`.
+    - timeout: The deadline of the phase, in seconds.
+    """
+
+    def __init__(self, phase, timeout):
+        super().__init__(f"The {phase} phase of the update timed out after {timeout} s")
+        self.phase = phase
+        self.timeout = timeout
+
+
+class RequestTimeoutError(TransferTimeoutError):
+    """The tag didn't respond to a request before the deadline."""
+
+
+class BlockTimeoutError(TransferTimeoutError):
+    """The tag didn't request the next image block before the deadline."""
+
+
+class UpdateTimeoutError(TransferTimeoutError):
+    """The whole update, including reconnections, didn't complete before the deadline."""
+
+
+class Timeouts:
+    """
+    Deadlines of the phases of the update of a tag, in seconds, or `None` to wait forever.
+
+    Attributes:
+    - block_size: For the response to the block size request.
+    - write_screen: For the response to the write screen request.
+    - start_transfer: For the request of the first image block, after the start transfer request.
+    - block: For the request of each following image block, or for the end of the transfer.
+    - update: For the whole update, including reconnections.
+    - request: For the response to the other requests.
+    """
+
+    def __init__(
+        self,
+        block_size=5.0,
+        write_screen=5.0,
+        start_transfer=5.0,
+        block=5.0,
+        update=120.0,
+        request=5.0,
+    ):
+        self.block_size = block_size
+        self.write_screen = write_screen
+        self.start_transfer = start_transfer
+        self.block = block
+        self.update = update
+        self.request = request
+
+    def __repr__(self):
+        return f"Timeouts({', '.join(f'{key}={value}' for key, value in vars(self).items())})"
+
+
+async def wait_for_phase(awaitable, phase, timeout, error_type):
+    """Await `awaitable`, raising an `error_type` error if `phase` takes more than `timeout`."""
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except TransferTimeoutError:
+        # A nested phase timed out
+        raise
+    except asyncio.TimeoutError:
+        raise error_type(phase, timeout) from None
+
+
+# Errors after which an interrupted transfer is resumed on a new connection
+RESUMABLE_ERRORS = (BleakError, ConnectionError, asyncio.TimeoutError)
+
+
 class ScreenWriter:
     """
     Class to write an image to a screen device.
@@ -13,6 +99,33 @@ class ScreenWriter:
     - device: The `BleakClient` instance to which the image will be sent.
     - image: The encoded image data, as a `bytes` object.
     - block_size: The block size for the image transfer, as an `int` or `None` if not yet known.
+    - window:
+        The number of image blocks to keep in flight using write without response, or `None` to send
+        one block at a time, waiting for the tag to request the next one. The transfer falls back to
+        one block at a time if the tag requests a block out of sequence, or if it doesn't request any
+        block for a few round trips, e.g. because a block got lost, and goes back to the window once
+        the tag requests `WINDOW_RESUME_BLOCKS` blocks in sequence. It falls back until the next
+        connection if the blocks don't fit in the MTU of the connection, or if a write without
+        response fails.
+    - max_window: The `window` requested when creating the `ScreenWriter`.
+    - stall_timeout:
+        The maximum time to wait for the tag to request a block in window mode, in seconds. Once the
+        round trip time of the blocks is known, `STALL_ROUND_TRIPS` round trips are waited instead,
+        if shorter.
+    - round_trip: The moving average of the round trip time of the blocks, or `None` if unknown.
+    - timeouts: The `Timeouts` of the phases of the update.
+    - metrics: The `TransferMetrics` in which the timings of the update are recorded.
+    - block_messages:
+        The messages of the image blocks, as `memoryview`s of a single buffer, or `None` if the block
+        size is not yet known.
+    - request_characteristic, image_characteristic:
+        The GATT characteristics used for the requests and for the image blocks, resolved once by
+        `start_notify`.
+    - sent_parts: The number of image blocks that have been sent at least once on this connection.
+    - last_requested_part: The last image block requested by the tag on this connection, or `None`.
+    - acknowledged_parts:
+        The number of image blocks that the tag has acknowledged, by requesting the following ones.
+        Unlike the other attributes, it's kept across connections, see `attach`.
     - transfer_queue:
         An `asyncio.queues.Queue()` that will contain the data of the next image block to send, or `None` if the
         transfer is complete.
@@ -24,44 +137,120 @@ class ScreenWriter:
     REQUEST_CHARACTERISTIC = "0000fef1-0000-1000-8000-00805f9b34fb"
     IMAGE_CHARACTERISTIC = "0000fef2-0000-1000-8000-00805f9b34fb"
 
-    def __init__(self, device, image):
+    # Number of blocks requested in sequence after which the window is used again
+    WINDOW_RESUME_BLOCKS = 2
+    # Number of round trips without requests after which a block is considered lost
+    STALL_ROUND_TRIPS = 3
+    # Minimum time without requests after which a block is considered lost, in seconds
+    MIN_STALL_TIMEOUT = 0.05
+    # Weight of each new round trip time in `round_trip`
+    ROUND_TRIP_WEIGHT = 0.2
+
+    def __init__(
+        self,
+        device,
+        image,
+        window=None,
+        stall_timeout=1.0,
+        timeouts=None,
+        metrics=None,
+    ):
         logger.debug(f"Image data: {len(image)} bytes")
         assert len(image) > 0
-        self.device = device
+        assert window is None or window > 0
         self.image = image
         self.block_size = None
+        self.block_messages = None
+        self.request_characteristic = ScreenWriter.REQUEST_CHARACTERISTIC
+        self.image_characteristic = ScreenWriter.IMAGE_CHARACTERISTIC
+        self.max_window = window
+        self.stall_timeout = stall_timeout
+        self.round_trip = None
+        self.timeouts = Timeouts() if timeouts is None else timeouts
+        self.metrics = TransferMetrics() if metrics is None else metrics
+        self.metrics.bytes = len(image)
+        self.acknowledged_parts = 0
+        self.attach(device)
+
+    def attach(self, device):
+        """Prepare to write the image on a new connection to the tag.
+
+        The tag decides which block to request first: it can resume an interrupted transfer, or
+        restart it from the first block.
+        """
+        self.device = device
+        self.window = self.max_window
+        # Whether the window can be used again after falling back on this connection
+        self.window_resumable = True
+        self.blocks_in_sequence = 0
+        self.sent_parts = 0
+        self.last_requested_part = None
+        self.block_send_times = {}
         self.transfer_queue = asyncio.queues.Queue()
         self.notify_handler_results = asyncio.queues.Queue()
 
-    async def start_notify(self):
-        async def notify_handler_task(sender, data):
-            try:
-                await self.notify_handler(sender, data)
-            # Here we catch all exceptions to avoid "Task exception was never retrieved" errors
-            except Exception as e:
-                logger.error(f"Error in the notify handler: {e}")
-                await self.notify_handler_results.put(e)
-            else:
-                # Signal that the notification was handled correctly
-                await self.notify_handler_results.put(None)
+    def disconnected(self, device):
+        """Wake up the pending requests and the transfer when the connection to `device` is lost."""
+        if device is not self.device:
+            return
+        logger.debug("Disconnected")
+        error = TagDisconnectedError("The tag disconnected during the update")
+        self.transfer_queue.put_nowait(error)
+        self.notify_handler_results.put_nowait(error)
 
+    def resolve_characteristics(self):
+        """Look up the GATT characteristics once, instead of resolving their UUIDs on every write."""
+        services = self.device.services
+        self.request_characteristic = (
+            services.get_characteristic(ScreenWriter.REQUEST_CHARACTERISTIC)
+            or ScreenWriter.REQUEST_CHARACTERISTIC
+        )
+        self.image_characteristic = (
+            services.get_characteristic(ScreenWriter.IMAGE_CHARACTERISTIC)
+            or ScreenWriter.IMAGE_CHARACTERISTIC
+        )
+
+    async def handle_notification(self, sender, data):
+        try:
+            await self.notify_handler(sender, data)
+        # Here we catch all exceptions to avoid "Task exception was never retrieved" errors
+        except Exception as e:
+            logger.error(f"Error in the notify handler: {e}")
+            await self.notify_handler_results.put(e)
+        else:
+            # Signal that the notification was handled correctly
+            await self.notify_handler_results.put(None)
+
+    async def start_notify(self):
+        self.resolve_characteristics()
         await self.device.start_notify(
-            ScreenWriter.REQUEST_CHARACTERISTIC, notify_handler_task
+            self.request_characteristic, self.handle_notification
         )
 
     async def stop_notify(self):
         logger.debug(f"Stop notify")
-        await self.device.stop_notify(ScreenWriter.REQUEST_CHARACTERISTIC)
+        await self.device.stop_notify(self.request_characteristic)
 
-    async def _send_request(self, data):
-        logger.log(
-            logging.NOTSET,
-            f"Sending request message: {[data[i] for i in range(len(data))]}",
-        )
+    async def _send_request(self, data, phase, timeout):
         if not isinstance(data, bytes):
             data = bytes(data)
+        if capture.active_capture is not None:
+            capture.active_capture.record(PacketKind.REQUEST, self.device.address, data)
+        start = time.perf_counter()
+        with self.metrics.measure(phase):
+            await wait_for_phase(
+                self._send_request_and_wait(data),
+                phase,
+                timeout,
+                RequestTimeoutError,
+            )
+        # The round trip of the requests is a first estimate of the one of the blocks
+        if self.round_trip is None:
+            self.round_trip = time.perf_counter() - start
+
+    async def _send_request_and_wait(self, data):
         await self.device.write_gatt_char(
-            ScreenWriter.REQUEST_CHARACTERISTIC,
+            self.request_characteristic,
             data,
             response=True,
         )
@@ -71,59 +260,145 @@ class ScreenWriter:
         if result is not None:
             raise result
 
-    async def _send_write(self, data):
-        logger.log(
-            logging.NOTSET,
-            f"Sending image message: {[data[i] for i in range(len(data))]}",
-        )
+    async def _send_write(self, data, response=True):
+        if capture.active_capture is not None:
+            kind = PacketKind.IMAGE if response else PacketKind.IMAGE_NO_RESPONSE
+            capture.active_capture.record(kind, self.device.address, data)
         assert len(data) <= self.block_size
         await self.device.write_gatt_char(
-            ScreenWriter.IMAGE_CHARACTERISTIC,
+            self.image_characteristic,
             data,
-            response=True,
+            response=response,
         )
 
     async def request_block_size(self):
         logger.log(logging.NOTSET, "Request: block size")
-        await self._send_request([0x01])
+        await self._send_request([0x01], "block_size", self.timeouts.block_size)
 
     async def request_write_screen(self):
         assert self.block_size is not None and self.block_size > 0
         size = len(self.image)
         logger.debug(f"Request: write screen (size: {size})")
-        await self._send_request([0x02, *size.to_bytes(4, "little")])
+        await self._send_request(
+            [0x02, *size.to_bytes(4, "little")],
+            "write_screen",
+            self.timeouts.write_screen,
+        )
 
     async def request_start_transfer(self):
         logger.debug("Request: start transfer")
-        await self._send_request([0x03])
+        await self._send_request([0x03], "start_transfer", self.timeouts.start_transfer)
+
+    def fall_back(self, reason, resumable=True):
+        """Send one block at a time, until the window can be used again if `resumable`."""
+        logger.info(f"{reason}, falling back to sending one block at a time")
+        self.window = None
+        self.window_resumable = self.window_resumable and resumable
+        self.blocks_in_sequence = 0
+
+    def check_window(self):
+        """Fall back to one block at a time if the blocks don't fit in a write without response."""
+        if self.window is None:
+            return
+        mtu_size = self.device.mtu_size
+        if self.block_size > mtu_size - 3:
+            self.fall_back(
+                f"The blocks of {self.block_size} bytes don't fit the MTU of {mtu_size} bytes",
+                resumable=False,
+            )
+
+    def resume_window(self, part):
+        """Go back to the window once the tag requests enough blocks in sequence, after `part`."""
+        if self.max_window is None or not self.window_resumable:
+            return
+        if (
+            self.last_requested_part is not None
+            and part == self.last_requested_part + 1
+        ):
+            self.blocks_in_sequence += 1
+        else:
+            self.blocks_in_sequence = 0
+        if self.blocks_in_sequence >= ScreenWriter.WINDOW_RESUME_BLOCKS:
+            logger.info(
+                "The tag requests blocks in sequence again, resuming the window"
+            )
+            self.window = self.max_window
+            # The tag dropped the blocks sent ahead of the lost one, so they are sent again
+            self.sent_parts = part
+
+    @property
+    def block_stall_timeout(self):
+        """The time without requests after which a block is considered lost, in window mode."""
+        if self.round_trip is None:
+            return self.stall_timeout
+        return min(
+            self.stall_timeout,
+            max(
+                ScreenWriter.STALL_ROUND_TRIPS * self.round_trip,
+                ScreenWriter.MIN_STALL_TIMEOUT,
+            ),
+        )
 
     async def handle_transfer(self):
         logger.debug("Handle transfer")
         while True:
-            block = await self.transfer_queue.get()
+            if self.window is None or self.last_requested_part is None:
+                block = await wait_for_phase(
+                    self.transfer_queue.get(),
+                    "block",
+                    self.timeouts.block,
+                    BlockTimeoutError,
+                )
+            else:
+                try:
+                    block = await asyncio.wait_for(
+                        self.transfer_queue.get(), self.block_stall_timeout
+                    )
+                except asyncio.TimeoutError:
+                    self.fall_back("The tag stopped requesting blocks")
+                    block = self.last_requested_part
+            if isinstance(block, Exception):
+                raise block
+            self.record_round_trip(self.num_parts - 1 if block is None else block - 1)
             if block is None:
                 return
-            await self.send_image_block(block)
+            if self.last_requested_part is None and block > 0:
+                logger.info(f"Resuming the transfer at part {block + 1}")
+            if self.window is None:
+                self.resume_window(block)
+            if self.window is None:
+                self.last_requested_part = block
+                await self.send_image_block(block)
+            else:
+                await self.send_image_window(block)
 
     async def request_write_cancel(self):
         logger.debug("Request: write cancel")
-        await self._send_request([0x04])
+        await self._send_request([0x04], "cancel", self.timeouts.request)
 
     async def request_write_settings(self, settings):
-        await self._send_request([0x40, *settings])
+        await self._send_request([0x40, *settings], "settings", self.timeouts.request)
 
     async def request_set_address(self, address):
-        await self._send_request([0x19, *address[0:6:-1]])
+        await self._send_request(
+            [0x19, *address[0:6:-1]], "set_address", self.timeouts.request
+        )
 
     async def notify_handler(self, _characteristic, data):
-        logger.log(
-            logging.NOTSET, f"Received notify: {[data[i] for i in range(len(data))]}"
-        )
+        if capture.active_capture is not None:
+            capture.active_capture.record(
+                PacketKind.NOTIFICATION, self.device.address, data
+            )
         if data[0] == 0x01:
             assert len(data) == 3
             logger.debug(f"Success: block size request")
-            self.block_size = int.from_bytes(data[1:], "little")
-            logger.debug(f"Received block size: {self.block_size}")
+            block_size = int.from_bytes(data[1:], "little")
+            logger.debug(f"Received block size: {block_size}")
+            if block_size != self.block_size:
+                self.block_size = block_size
+                self.acknowledged_parts = 0
+                self.build_block_messages()
+                self.metrics.blocks = self.num_parts
         elif data[0] == 0x02:
             if data[1] == 0x00:
                 logger.debug("Success: write screen request")
@@ -137,11 +412,16 @@ class ScreenWriter:
         elif data[0] == 0x05:
             if data[1] == 0x00:
                 logger.debug(f"Success: image transfer request")
+                part = int.from_bytes(data[2:6], "little")
+                if part < self.acknowledged_parts:
+                    logger.info(f"The tag restarted the transfer from part {part + 1}")
+                self.acknowledged_parts = part
                 # Push a new block to be sent by `handle_transfer`
-                await self.transfer_queue.put(int.from_bytes(data[2:6], "little"))
+                await self.transfer_queue.put(part)
             elif data[1] == 0x08:
                 logger.debug(f"Success: image transfer request")
                 logger.debug(f"Screen write complete")
+                self.acknowledged_parts = self.num_parts
                 # Signal to `handle_transfer` that the transfer is complete
                 await self.transfer_queue.put(None)
             else:
@@ -155,36 +435,274 @@ class ScreenWriter:
         else:
             logger.error(f"Unknown state: {data}")
 
-    async def send_image_block(self, part):
+    def build_block_messages(self):
+        """Build the messages of all the image blocks at once, in a single buffer.
+
+        Each message is the 4-byte part number followed by the image data of the block.
+        """
         img_block_size = self.block_size - 4
+        assert img_block_size > 0, f"Invalid block size: {self.block_size}"
         num_parts = math.ceil(len(self.image) / img_block_size)
+        image = memoryview(self.image)
+        buffer = bytearray(len(self.image) + 4 * num_parts)
+        messages = memoryview(buffer)
+        self.block_messages = []
+        for part in range(num_parts):
+            image_block = image[part * img_block_size : (part + 1) * img_block_size]
+            start = part * self.block_size
+            end = start + 4 + len(image_block)
+            buffer[start : start + 4] = part.to_bytes(4, "little")
+            buffer[start + 4 : end] = image_block
+            self.block_messages.append(messages[start:end])
+
+    @property
+    def num_parts(self):
+        return len(self.block_messages)
+
+    async def send_image_window(self, part):
+        """Handle the request of the tag for `part`, keeping up to `window` blocks in flight."""
+        if self.last_requested_part is None:
+            # The first request on this connection, which can resume an interrupted transfer
+            expected_part = self.sent_parts = part
+        else:
+            expected_part = self.last_requested_part + 1
+        self.last_requested_part = part
+        if part != expected_part or part > self.sent_parts:
+            # The tag lost or rejected a block, so stop sending blocks ahead of its requests
+            self.fall_back(
+                f"The tag requested part {part + 1} instead of {expected_part + 1}"
+            )
+            await self.send_image_block(part)
+            return
+
+        end_part = min(part + self.window, self.num_parts)
+        while self.sent_parts < end_part:
+            try:
+                await self.send_image_block(self.sent_parts, response=False)
+            except BleakError as e:
+                if not self.device.is_connected:
+                    raise
+                self.fall_back(f"Write without response failed ({e})", resumable=False)
+                # Otherwise, the blocks in flight are followed by the requests of the tag
+                if self.sent_parts == part:
+                    await self.send_image_block(part)
+                return
+
+    def record_round_trip(self, part):
+        """Record the round trip time of `part`, now that the tag requested the following block."""
+        send_time = self.block_send_times.pop(part, None)
+        if send_time is None:
+            return
+        round_trip = time.perf_counter() - send_time
+        self.metrics.block_round_trips.append(round_trip)
+        if self.round_trip is None:
+            self.round_trip = round_trip
+        else:
+            weight = ScreenWriter.ROUND_TRIP_WEIGHT
+            self.round_trip += weight * (round_trip - self.round_trip)
+
+    async def send_image_block(self, part, response=True):
         assert (
-            part < num_parts
-        ), f"Part {part} is too high, there are only {num_parts} parts."
-        logger.info(f"Sending image part {part + 1}/{num_parts}")
-        image_block = self.image[
-            part * img_block_size : part * img_block_size + img_block_size
-        ]
-        assert 0 < len(image_block) <= img_block_size
-        message = bytearray([*part.to_bytes(4, "little"), *image_block])
-        await self._send_write(message)
-
-
-async def send_data_to_screen(address, image_data):
-    logger.info(f"Connecting to {address}...")
-    async with BleakClient(address) as device:
-        # BlueZ doesn't have a proper way to get the MTU, so we have this hack.
-        # If this doesn't work for you, you can set the device._mtu_size attribute
-        # to override the value instead.
-        if device._backend.__class__.__name__ == "BleakClientBlueZDBus":
-            await device._backend._acquire_mtu()
-        logger.debug(f"MTU: {device.mtu_size}")
-
-        screen = ScreenWriter(device, image_data)
+            part < self.num_parts
+        ), f"Part {part} is too high, there are only {self.num_parts} parts."
+        # Lazy formatting, since this is called for every block
+        logger.debug("Sending image part %d/%d", part + 1, self.num_parts)
+        self.block_send_times[part] = time.perf_counter()
+        await self._send_write(self.block_messages[part], response=response)
+        self.sent_parts = max(self.sent_parts, part + 1)
+
+    async def write(self, subscribe=True):
+        """Write the image on the current connection, following the requests of the tag.
+
+        If `subscribe` is false, the notifications of the tag must already be forwarded to
+        `handle_notification`, like `GiciskyClient` does.
+        """
         logger.info(f"Sending image data...")
-        await screen.start_notify()
-        await screen.request_block_size()
-        await screen.request_write_screen()
-        await screen.request_start_transfer()
-        await screen.handle_transfer()
-        await screen.stop_notify()
+        if subscribe:
+            await self.start_notify()
+        else:
+            self.resolve_characteristics()
+        await self.request_block_size()
+        self.check_window()
+        await self.request_write_screen()
+        await self.request_start_transfer()
+        await self.handle_transfer()
+        if subscribe:
+            await self.stop_notify()
+
+
+async def write_image(device, image_data, window=None, timeouts=None, metrics=None):
+    """Write the encoded image data to a connected `device`, like a `BleakClient`."""
+    screen = ScreenWriter(
+        device, image_data, window=window, timeouts=timeouts, metrics=metrics
+    )
+    with screen.metrics.measure("update"):
+        await wait_for_phase(
+            screen.write(), "update", screen.timeouts.update, UpdateTimeoutError
+        )
+
+
+async def write_image_resumable(
+    connect,
+    image_data,
+    window=None,
+    reconnects=2,
+    reconnect_delay=1.0,
+    timeouts=None,
+    metrics=None,
+    subscribe=True,
+):
+    """Write the encoded image data, reconnecting and resuming the transfer if the connection drops.
+
+    `connect` is called with the `ScreenWriter` of the update, and must return an async context
+    manager that yields the connected device, like `connect_to_tag`. The device must report its
+    disconnection to `ScreenWriter.disconnected`. See `ScreenWriter.write` for `subscribe`.
+
+    The transfer is retried up to `reconnects` times, waiting `reconnect_delay` seconds before the
+    first retry and doubling the delay at each one. Request and block timeouts are retried too, but
+    not the `update` timeout of `timeouts`, which bounds the whole update.
+    """
+    screen = ScreenWriter(
+        None, image_data, window=window, timeouts=timeouts, metrics=metrics
+    )
+
+    async def write_with_reconnects():
+        for attempt in range(reconnects + 1):
+            if attempt > 0:
+                delay = reconnect_delay * 2 ** (attempt - 1)
+                logger.info(
+                    f"Reconnecting in {delay:.1f} s (attempt {attempt}/{reconnects}), "
+                    f"{screen.acknowledged_parts} parts already acknowledged"
+                )
+                await asyncio.sleep(delay)
+            try:
+                async with connect(screen) as device:
+                    screen.attach(device)
+                    await screen.write(subscribe=subscribe)
+                return
+            except RESUMABLE_ERRORS as e:
+                if attempt == reconnects:
+                    raise
+                logger.warning(f"Transfer interrupted: {e}")
+
+    with screen.metrics.measure("update"):
+        await wait_for_phase(
+            write_with_reconnects(),
+            "update",
+            screen.timeouts.update,
+            UpdateTimeoutError,
+        )
+
+
+async def acquire_mtu(device, metrics):
+    """Make sure that the MTU of the connected `BleakClient` is known.
+
+    The MTU of the last connection to a recently seen tag is reused, see `TagRegistry`.
+    """
+    # BlueZ doesn't have a proper way to get the MTU, so we have this hack.
+    # If this doesn't work for you, you can set the device._mtu_size attribute
+    # to override the value instead.
+    seen = tag_registry.get(device.address)
+    with metrics.measure("mtu"):
+        backend = getattr(device, "_backend", None)
+        if backend.__class__.__name__ == "BleakClientBlueZDBus":
+            if seen is not None and seen.mtu_size is not None:
+                backend._mtu_size = seen.mtu_size
+            else:
+                await backend._acquire_mtu()
+    logger.debug(f"MTU: {device.mtu_size}")
+    tag_registry.set_mtu_size(device.address, device.mtu_size)
+
+
+async def connect_client(address, adapter, disconnected_callback, metrics):
+    """Connect to the tag at `address`, returning the connected `BleakClient`.
+
+    If connecting to the `BLEDevice` of a tag recorded in the registry fails, e.g. because it was
+    restored from a stale `ScanCache`, the tag is forgotten and the connection is retried with its
+    plain address.
+    """
+    device = resolve_device(address, adapter=adapter)
+    address = device_address(address)
+    logger.info(f"Connecting to {address}...")
+    client_kwargs = {} if adapter is None else {"adapter": adapter}
+    client = BleakClient(
+        device, disconnected_callback=disconnected_callback, **client_kwargs
+    )
+    with metrics.measure("connect"):
+        try:
+            await client.connect()
+        except BleakError as e:
+            if isinstance(device, str) or tag_registry.get(address) is None:
+                raise
+            logger.info(f"Failed to connect to the cached device {address}: {e}")
+            tag_registry.forget(address)
+            client = BleakClient(
+                address, disconnected_callback=disconnected_callback, **client_kwargs
+            )
+            await client.connect()
+    return client
+
+
+@contextlib.asynccontextmanager
+async def connect_to_tag(
+    address, adapter=None, disconnected_callback=None, metrics=None
+):
+    """Connect to the tag at `address`, yielding the connected `BleakClient`.
+
+    `address` is a `BLEDevice` or a Bluetooth address. Connecting to a `BLEDevice`, or to the
+    address of a device recently seen by the scanner, avoids a new scan for the device. On BlueZ,
+    `adapter` selects the Bluetooth adapter to use (e.g. `"hci1"`). The time spent connecting and
+    acquiring the MTU is recorded in `metrics`, if provided.
+    """
+    metrics = TransferMetrics(device_address(address)) if metrics is None else metrics
+    device = await connect_client(address, adapter, disconnected_callback, metrics)
+    try:
+        await acquire_mtu(device, metrics)
+        yield device
+    finally:
+        await device.disconnect()
+
+
+async def send_data_to_screen(
+    address,
+    image_data,
+    store=None,
+    window=None,
+    adapter=None,
+    reconnects=2,
+    reconnect_delay=1.0,
+    timeouts=None,
+    metrics=None,
+):
+    """Send the encoded image data to the tag at `address`, a `BLEDevice` or a Bluetooth address.
+
+    If a `PayloadStore` is provided, the update is skipped when the tag already shows the same image
+    data, and the image data is recorded in the store once the update succeeds. Returns whether the
+    image data has been sent. See `ScreenWriter` for the meaning of `window` and `timeouts`,
+    `connect_to_tag` for `adapter` and `write_image_resumable` for `reconnects` and
+    `reconnect_delay`. The timings of the update are recorded in `metrics`, if provided.
+    """
+    device = address
+    address = device_address(device)
+    if store is not None and store.is_unchanged(address, image_data):
+        logger.info(f"The image of {address} is unchanged, skipping the update.")
+        return False
+
+    await write_image_resumable(
+        lambda screen: connect_to_tag(
+            device,
+            adapter=adapter,
+            disconnected_callback=screen.disconnected,
+            metrics=screen.metrics,
+        ),
+        image_data,
+        window=window,
+        reconnects=reconnects,
+        reconnect_delay=reconnect_delay,
+        timeouts=timeouts,
+        metrics=TransferMetrics(address) if metrics is None else metrics,
+    )
+
+    if store is not None:
+        store.record(address, image_data)
+    return True
@@ -0,0 +1,40 @@
+import asyncio
+from gicisky_tag.capture import (
+    PacketKind,
+    start_capture,
+    stop_capture,
+    read_capture,
+    replay_transfers,
+)
+from gicisky_tag.simulator import SimulatedTag
+from gicisky_tag.writer import write_image
+
+IMAGE_DATA = bytes(range(256)) * 20
+
+
+async def write_to_tag(tag, image_data, **kwargs):
+    async with tag:
+        await write_image(tag, image_data, **kwargs)
+
+
+def test_capture_replay(tmp_path):
+    path = tmp_path / "capture.bin"
+    start_capture(path)
+    try:
+        asyncio.run(write_to_tag(SimulatedTag(), IMAGE_DATA))
+        # Blocks lost in window mode are sent again, and replayed once
+        tag = SimulatedTag(address="FF:FF:00:00:00:02", loss=0.2, seed=1)
+        asyncio.run(write_to_tag(tag, IMAGE_DATA[::-1], window=4))
+    finally:
+        stop_capture()
+
+    packets = list(read_capture(path))
+    kinds = {packet.kind for packet in packets}
+    assert kinds == set(PacketKind)
+    transfers = [
+        (packet.address, image_data) for packet, image_data in replay_transfers(packets)
+    ]
+    assert transfers == [
+        ("FF:FF:00:00:00:01", IMAGE_DATA),
+        ("FF:FF:00:00:00:02", IMAGE_DATA[::-1]),
+    ]
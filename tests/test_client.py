@@ -0,0 +1,67 @@
+import math
+import asyncio
+from gicisky_tag.client import GiciskyClient
+from gicisky_tag.simulator import SimulatedTag
+
+IMAGE_DATA = bytes(range(256)) * 20
+
+
+class CountingTag(SimulatedTag):
+    """A `SimulatedTag` that counts its connections."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.num_connections = 0
+
+    async def connect(self):
+        self.num_connections += 1
+        await super().connect()
+
+
+def simulated_client(tag, **kwargs):
+    client = GiciskyClient(tag.address, device=tag, reconnect_delay=0.0, **kwargs)
+    tag.disconnected_callback = client.disconnected
+    return client
+
+
+def test_sends_reuse_connection():
+    async def run():
+        tag = CountingTag()
+        async with simulated_client(tag) as client:
+            await client.send(IMAGE_DATA)
+            assert tag.image_data == IMAGE_DATA
+            await client.send(IMAGE_DATA[::-1])
+            assert tag.image_data == IMAGE_DATA[::-1]
+            assert client.is_connected
+        assert not client.is_connected
+        assert tag.num_connections == 1
+
+    asyncio.run(run())
+
+
+def test_idle_connection_closed():
+    async def run():
+        tag = CountingTag()
+        async with simulated_client(tag, idle_timeout=0.05) as client:
+            await client.send(IMAGE_DATA)
+            await asyncio.sleep(0.2)
+            assert not client.is_connected
+            await client.send(IMAGE_DATA[::-1])
+            assert tag.image_data == IMAGE_DATA[::-1]
+        assert tag.num_connections == 2
+
+    asyncio.run(run())
+
+
+def test_dropped_connection_resumed():
+    async def run():
+        tag = CountingTag(disconnect_after=10)
+        async with simulated_client(tag) as client:
+            await client.send(IMAGE_DATA)
+            assert tag.image_data == IMAGE_DATA
+            assert client.is_connected
+        assert tag.num_connections == 2
+        # Only the block written when the link dropped is sent again
+        assert tag.num_writes == math.ceil(len(IMAGE_DATA) / (tag.block_size - 4)) + 1
+
+    asyncio.run(run())
@@ -0,0 +1,42 @@
+import pytest
+import numpy as np
+from utils.decompress import recreate_line
+from gicisky_tag.encoder import encode_line, Compression
+from gicisky_tag.decoder import decode_line
+
+
+def random_lines(num_lines=200, seed=0):
+    """Random lines made of runs of repeated bytes, of the sizes used by the models."""
+    rng = np.random.default_rng(seed)
+    for index in range(num_lines):
+        line = bytearray()
+        size = (16, 37, 64)[index % 3]
+        while len(line) < size:
+            value = rng.choice([0x00, 0xFF, rng.integers(256)])
+            line += bytes([value]) * int(rng.choice([1, 1, 2, 3, 17, 18, 40]))
+        yield bytes(line[:size])
+
+
+@pytest.mark.parametrize("compression", list(Compression))
+def test_encode_decode_lines(compression):
+    for line in random_lines():
+        encoded_line = encode_line(line, compression)
+        assert decode_line(encoded_line) == line
+        # Check against the reference decompressor of the Cabalist notes
+        bits = "".join(f"{byte:08b}" for byte in line)
+        assert recreate_line(encoded_line.hex()) == bits
+
+
+def test_compression_saves_bytes():
+    for line in random_lines():
+        assert len(encode_line(line, Compression.FAST)) <= len(
+            encode_line(line, Compression.NONE)
+        )
+    assert len(encode_line(bytes(64), Compression.FAST)) < 7 + 64
+
+
+def test_max_compression_is_smallest():
+    for line in random_lines(num_lines=500, seed=1):
+        assert len(encode_line(line, Compression.MAX)) <= len(
+            encode_line(line, Compression.FAST)
+        )
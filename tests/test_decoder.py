@@ -0,0 +1,32 @@
+from pathlib import Path
+from utils.decompress import recreate_line
+from gicisky_tag.decoder import decode_image, decode_line, split_lines
+
+CAPTURES_FOLDER = (
+    Path(__file__).parent.parent / "docs/Cabalist_notes/successful_img_captures"
+)
+
+
+def read_capture(name):
+    """Read the image data of a capture of the official app, without the part numbers."""
+    lines = (CAPTURES_FOLDER / name).read_text().split()
+    return b"".join(bytes.fromhex(line)[4:] for line in lines)
+
+
+def test_decode_official_capture():
+    image_data = read_capture("white_black.txt")
+    # The official app writes the size of an uncompressed color plane in the prefix
+    assert int.from_bytes(image_data[:4], "little") == 400 * 300 // 8
+    bw_bitmap, red_bitmap = decode_image(image_data, "4.2-bwr")
+    assert bw_bitmap.shape == (300, 400)
+    assert bw_bitmap.any() and not bw_bitmap.all()
+    assert not red_bitmap.any()
+    for line in split_lines(image_data):
+        bits = "".join(f"{byte:08b}" for byte in decode_line(line))
+        assert bits == recreate_line(line.hex())
+
+
+def test_decode_white_capture():
+    bw_bitmap, red_bitmap = decode_image(read_capture("white.txt"), "4.2-bwr")
+    assert bw_bitmap.all()
+    assert not red_bitmap.any()
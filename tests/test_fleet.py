@@ -0,0 +1,22 @@
+import asyncio
+from bleak.backends.device import BLEDevice
+from gicisky_tag.fleet import ConnectionSlots
+
+
+def test_connection_slots():
+    async def run():
+        slots = ConnectionSlots(["hci0", "hci1"], max_connections=1)
+        path = "/org/bluez/hci1/dev_FF_FF_00_00_00_01"
+        device = BLEDevice("FF:FF:00:00:00:01", None, {"path": path}, rssi=-60)
+        assert slots.adapter_for(device) == "hci1"
+        assert slots.adapter_for(device.address) is None
+        assert await slots.acquire(slots.adapter_for(device)) == "hci1"
+        # The device can only be connected through hci1, even if hci0 is free
+        waiting = asyncio.create_task(slots.acquire("hci1"))
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+        assert await slots.acquire() == "hci0"
+        await slots.release("hci1")
+        assert await waiting == "hci1"
+
+    asyncio.run(run())
@@ -0,0 +1,44 @@
+import pytest
+import numpy as np
+from PIL import Image
+from gicisky_tag.encoder import encode_image, Compression
+from gicisky_tag.decoder import decode_image
+from gicisky_tag.models import MODELS
+
+
+def random_image(model, seed=0):
+    """A random black, white and red image of the size of `model`."""
+    colors = np.array([[0, 0, 0], [255, 255, 255], [255, 0, 0]], dtype=np.uint8)
+    indices = np.random.default_rng(seed).integers(0, 3, (model.height, model.width))
+    return Image.fromarray(colors[indices], "RGB")
+
+
+def test_line_sizes():
+    assert MODELS["2.1-bwr"].line_sizes == (16,) * 250
+    # 15000 bytes per plane, in lines of 64 bytes and a last line of 24 bytes
+    assert MODELS["4.2-bwr"].line_sizes == (64,) * 234 + (24,)
+
+
+def test_size_prefix():
+    image_data = encode_image(random_image(MODELS["2.1-bwr"]), model="2.1-bwr")
+    assert int.from_bytes(image_data[:4], "little") == len(image_data) - 4
+    # Like the captures of the official app, the prefix of the 4.2" screen is the plane size
+    image_data = encode_image(random_image(MODELS["4.2-bwr"]), model="4.2-bwr")
+    assert int.from_bytes(image_data[:4], "little") == 400 * 300 // 8
+
+
+@pytest.mark.parametrize("compression", list(Compression))
+def test_encode_decode_models(compression):
+    for model in MODELS.values():
+        image = random_image(model)
+        image_data = encode_image(image, model=model, compression=compression)
+        bw_bitmap, red_bitmap = decode_image(image_data, model)
+        pixels = np.asarray(image)
+        assert (bw_bitmap == (pixels[..., 1] == 255)).all()
+        if model.red:
+            assert (red_bitmap == (pixels[..., 0] > pixels[..., 1])).all()
+
+
+def test_wrong_image_size():
+    with pytest.raises(ValueError):
+        encode_image(random_image(MODELS["4.2-bwr"]), model="2.1-bwr")
@@ -0,0 +1,30 @@
+from bleak.backends.device import BLEDevice
+from gicisky_tag.scanner import TagRegistry, resolve_device
+
+ADDRESS = "FF:FF:00:00:00:01"
+
+
+def bluez_device(adapter):
+    path = f"/org/bluez/{adapter}/dev_{ADDRESS.replace(':', '_')}"
+    return BLEDevice(ADDRESS, None, {"path": path, "props": {}}, rssi=-60)
+
+
+def test_resolve_device_adapter():
+    registry = TagRegistry()
+    assert resolve_device(ADDRESS, registry) == ADDRESS
+    device = bluez_device("hci1")
+    registry.add(device, -60, bytes(5))
+    assert resolve_device(ADDRESS, registry) is device
+    assert resolve_device(ADDRESS, registry, adapter="hci1") is device
+    # Connecting to the device would go through hci1, whatever the requested adapter
+    assert resolve_device(ADDRESS, registry, adapter="hci0") == ADDRESS
+    assert resolve_device(device, registry, adapter="hci0") == ADDRESS
+
+
+def test_resolve_device_without_details():
+    # Like the devices restored by `ScanCache` on macOS and Windows
+    registry = TagRegistry()
+    device = BLEDevice(ADDRESS, None, None, rssi=-60)
+    registry.add(device, -60, bytes(5))
+    assert resolve_device(ADDRESS, registry) == ADDRESS
+    assert resolve_device(device, registry) == ADDRESS
@@ -0,0 +1,84 @@
+import time
+import asyncio
+import pytest
+from bleak.backends.device import BLEDevice
+from gicisky_tag.scanner import TagRegistry
+from gicisky_tag.scheduler import UpdateJob, schedule_updates
+
+IMAGE_DATA = bytes(4000)
+
+
+class StubScreen:
+    """A stub of `send_data_to_screen`, recording the updates and failing the first `failures`."""
+
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+        self.updates = []
+
+    async def __call__(self, address, image_data, adapter=None, metrics=None, **kwargs):
+        address = getattr(address, "address", address)
+        self.updates.append((address, adapter))
+        await asyncio.sleep(0)
+        if address in self.failures:
+            self.failures.remove(address)
+            raise OSError("Connection failed")
+        return True
+
+
+@pytest.fixture
+def screen(monkeypatch):
+    screen = StubScreen()
+    monkeypatch.setattr("gicisky_tag.fleet.send_data_to_screen", screen)
+    return screen
+
+
+def run_jobs(jobs, **kwargs):
+    return asyncio.run(
+        schedule_updates(jobs, max_connections=1, registry=TagRegistry(), **kwargs)
+    )
+
+
+def test_priority_and_slack(screen):
+    now = time.time()
+    jobs = [
+        UpdateJob("AA:00:00:00:00:01", IMAGE_DATA),
+        UpdateJob("AA:00:00:00:00:02", IMAGE_DATA, deadline=now + 100),
+        UpdateJob("AA:00:00:00:00:03", IMAGE_DATA, deadline=now + 10),
+        UpdateJob("AA:00:00:00:00:04", IMAGE_DATA, priority=1),
+        # Too late to meet its deadline, so it goes with the jobs without deadline
+        UpdateJob("AA:00:00:00:00:05", IMAGE_DATA, deadline=now - 1),
+    ]
+    results = run_jobs(jobs)
+    assert [address[-1] for address, _ in screen.updates] == ["4", "3", "2", "1", "5"]
+    assert all(result.success for result in results)
+
+
+def test_retries_after_first_attempts(screen):
+    screen.failures = ["AA:00:00:00:00:01"]
+    jobs = [UpdateJob(f"AA:00:00:00:00:0{i}", IMAGE_DATA) for i in (1, 2, 3)]
+    results = run_jobs(jobs, retries=1)
+    assert [address[-1] for address, _ in screen.updates] == ["1", "2", "3", "1"]
+    assert results[0].success and results[0].retries == 1
+    assert results[0].error is None
+
+
+def test_missed_deadline(screen):
+    now = time.time()
+    screen.failures = ["AA:00:00:00:00:03"]
+    jobs = [
+        UpdateJob("AA:00:00:00:00:01", IMAGE_DATA, deadline=now + 100),
+        UpdateJob("AA:00:00:00:00:02", IMAGE_DATA, deadline=now - 1),
+        UpdateJob("AA:00:00:00:00:03", IMAGE_DATA, deadline=now + 100),
+        UpdateJob("AA:00:00:00:00:04", IMAGE_DATA),
+    ]
+    results = run_jobs(jobs)
+    assert [result.missed_deadline for result in results] == [False, True, True, False]
+    assert isinstance(results[2].error, OSError)
+
+
+def test_device_adapter(screen):
+    path = "/org/bluez/hci1/dev_AA_00_00_00_00_01"
+    device = BLEDevice("AA:00:00:00:00:01", None, {"path": path}, rssi=-60)
+    run_jobs([UpdateJob(device, IMAGE_DATA)], adapters=["hci0", "hci1"])
+    # The device is connected on the adapter that saw it, not on hci0, the first free one
+    assert screen.updates == [("AA:00:00:00:00:01", "hci1")]
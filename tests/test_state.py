@@ -0,0 +1,51 @@
+import time
+from bleak.backends.device import BLEDevice
+from gicisky_tag.scanner import TagRegistry, DEVICE_CACHE_MAX_AGE
+from gicisky_tag.state import PayloadStore, ScanCache
+
+
+def test_payload_store(tmp_path):
+    path = tmp_path / "state.db"
+    with PayloadStore(path) as store:
+        assert not store.is_unchanged("ff:ff:00:00:00:01", b"image")
+        store.record("ff:ff:00:00:00:01", b"image")
+        assert store.is_unchanged("FF:FF:00:00:00:01", b"image")
+        assert not store.is_unchanged("FF:FF:00:00:00:01", b"other image")
+        assert not store.is_unchanged("FF:FF:00:00:00:02", b"image")
+
+    # The store persists across runs
+    with PayloadStore(path) as store:
+        assert store.is_unchanged("ff:ff:00:00:00:01", b"image")
+        store.forget("Ff:fF:00:00:00:01")
+        assert not store.is_unchanged("FF:FF:00:00:00:01", b"image")
+
+
+def test_scan_cache(tmp_path):
+    path = tmp_path / "scan.db"
+    registry = TagRegistry()
+    device_path = "/org/bluez/hci0/dev_FF_FF_00_00_00_01"
+    bluez_device = BLEDevice(
+        "FF:FF:00:00:00:01", "NEMR", {"path": device_path}, rssi=-60
+    )
+    registry.add(bluez_device, -60, bytes(5)).mtu_size = 247
+    other_device = BLEDevice("FF:FF:00:00:00:02", "NEMR", None, rssi=-70)
+    registry.add(other_device, -70, bytes(5)).last_seen = time.time() - 120
+    with ScanCache(path, ttl=3600) as scan_cache:
+        scan_cache.save(registry)
+
+    # Only the tags seen in the last `ttl` seconds are loaded, and `max_age` is never lowered
+    registry = TagRegistry()
+    with ScanCache(path, ttl=30) as scan_cache:
+        assert scan_cache.load(registry) == 1
+    assert registry.max_age == DEVICE_CACHE_MAX_AGE
+    seen = registry.get("ff:ff:00:00:00:01")
+    assert seen.device.details["path"] == device_path
+    assert seen.mtu_size == 247
+
+    # The registry keeps the loaded tags for `ttl` seconds
+    registry = TagRegistry()
+    with ScanCache(path, ttl=3600) as scan_cache:
+        assert scan_cache.load(registry) == 2
+    assert registry.max_age == 3600
+    # Without a D-Bus path, the device can't be used to connect
+    assert registry.get("FF:FF:00:00:00:02").device.details is None
@@ -0,0 +1,108 @@
+import math
+import asyncio
+import contextlib
+import pytest
+from bleak.exc import BleakError
+from gicisky_tag.simulator import SimulatedTag
+from gicisky_tag.writer import (
+    ScreenWriter,
+    Timeouts,
+    RequestTimeoutError,
+    write_image,
+    write_image_resumable,
+)
+
+IMAGE_DATA = bytes(range(256)) * 20
+
+
+class FlakyTag(SimulatedTag):
+    """A `SimulatedTag` on which the writes without response fail after `num_writes` writes."""
+
+    def __init__(self, num_writes, **kwargs):
+        super().__init__(**kwargs)
+        self.failing_writes_after = num_writes
+
+    async def write_gatt_char(self, characteristic, data, response=None):
+        if not response and self.num_writes >= self.failing_writes_after:
+            raise BleakError("Write without response failed")
+        await super().write_gatt_char(characteristic, data, response=response)
+
+
+class RecordingTag(SimulatedTag):
+    """A `SimulatedTag` that records whether each image block is written with response."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.responses = []
+
+    async def write_gatt_char(self, characteristic, data, response=None):
+        if str(characteristic) == ScreenWriter.IMAGE_CHARACTERISTIC:
+            self.responses.append(bool(response))
+        await super().write_gatt_char(characteristic, data, response=response)
+
+
+class SilentTag(SimulatedTag):
+    """A `SimulatedTag` that stopped answering the requests."""
+
+    def notify(self, data):
+        pass
+
+
+def connect_to_simulated_tag(tag):
+    """A `connect` function for `write_image_resumable`, which connects to `tag` each time."""
+
+    @contextlib.asynccontextmanager
+    async def connect(screen):
+        tag.disconnected_callback = screen.disconnected
+        async with tag:
+            yield tag
+
+    return connect
+
+
+async def write_to_tag(tag, image_data=IMAGE_DATA, **kwargs):
+    async with tag:
+        await write_image(tag, image_data, **kwargs)
+    return tag
+
+
+def test_window_small_mtu():
+    tag = SimulatedTag(mtu_size=185)
+    asyncio.run(write_to_tag(tag, window=4))
+    assert tag.image_data == IMAGE_DATA
+
+
+def test_window_write_without_response_fails():
+    for num_writes in (0, 2):
+        tag = FlakyTag(num_writes)
+        asyncio.run(write_to_tag(tag, window=4))
+        assert tag.image_data == IMAGE_DATA
+
+
+def test_resume_after_disconnection():
+    tag = SimulatedTag(disconnect_after=10)
+    asyncio.run(
+        write_image_resumable(
+            connect_to_simulated_tag(tag), IMAGE_DATA, reconnect_delay=0.0
+        )
+    )
+    assert tag.image_data == IMAGE_DATA
+    # Only the block written when the link dropped is sent again
+    assert tag.num_writes == math.ceil(len(IMAGE_DATA) / (tag.block_size - 4)) + 1
+
+
+def test_window_with_loss():
+    tag = RecordingTag(latency=0.01, loss=0.2, seed=1)
+    asyncio.run(write_to_tag(tag, window=8))
+    assert tag.image_data == IMAGE_DATA
+    assert tag.num_lost_writes > 0
+    # After falling back to one block at a time, the window is used again
+    fall_back = tag.responses.index(True)
+    assert False in tag.responses[fall_back:]
+
+
+def test_request_timeout():
+    timeouts = Timeouts(block_size=0.1)
+    with pytest.raises(RequestTimeoutError) as error:
+        asyncio.run(write_to_tag(SilentTag(), timeouts=timeouts))
+    assert error.value.phase == "block_size"